@@ -0,0 +1,388 @@
+"""Constant memory accumulators for the quantities sampled along the Markov
+chain. Each sample is folded in O(1) so the memory footprint does not depend
+on the number of MonteCarlo steps."""
+
+import numpy as np
+
+class RunningMoments:
+    """Running mean and variance with Welford's algorithm"""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def push(self, value):
+        """Fold a new sample in the running mean and sum of squared
+        deviations"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(value - self.mean)
+
+    def push_array(self, values : np.ndarray):
+        """Fold a chunk of samples at once"""
+        if len(values) == 0:
+            return
+        chunk = RunningMoments()
+        chunk.count = len(values)
+        chunk.mean = float(np.mean(values))
+        chunk.m2 = float(np.sum((values - chunk.mean)**2))
+        self.merge(chunk)
+
+    def variance(self) -> float :
+        """Unbiased sample variance"""
+        if self.count < 2:
+            return 0.0
+        return self.m2/(self.count - 1)
+
+    def merge(self, other):
+        """Combine the moments of another set of samples (Chan et al.)"""
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta*other.count/count
+        self.m2 += other.m2 + delta**2*self.count*other.count/count
+        self.count = count
+
+    def get_state(self) -> np.ndarray :
+        return np.array([self.count, self.mean, self.m2], dtype=np.float64)
+
+    def set_state(self, state : np.ndarray):
+        self.count = int(state[0])
+        self.mean = float(state[1])
+        self.m2 = float(state[2])
+
+class StreamingAccumulator:
+    """Running moments of energy, order and tau, integer histogram of the
+    diagram order and fixed-bin histogram of the electron lifetime tau in
+    [0, max_time]"""
+    def __init__(self, max_time : float, tau_bins : int = 50):
+        self.energy = RunningMoments()
+        self.order = RunningMoments()
+        self.tau = RunningMoments()
+        self.order_histogram = np.zeros(64, dtype=np.int64)
+        self.tau_edges = np.linspace(0, max_time, tau_bins + 1)
+        self.tau_histogram = np.zeros(tau_bins, dtype=np.int64)
+        self.tau_bin_width = max_time/tau_bins
+
+    def push(self, order : int, energy : float, tau : float):
+        """Fold the observables of the current diagram"""
+        self.energy.push(energy)
+        self.order.push(order)
+        self.tau.push(tau)
+        if order >= len(self.order_histogram):
+            self.order_histogram = np.concatenate(
+                (self.order_histogram, np.zeros(order + 1, dtype=np.int64)))
+        self.order_histogram[order] += 1
+        tau_bin = min(int(tau/self.tau_bin_width), len(self.tau_histogram) - 1)
+        self.tau_histogram[tau_bin] += 1
+
+    def push_arrays(self, orders : np.ndarray, energies : np.ndarray, taus : np.ndarray):
+        """Fold chunks of samples at once"""
+        self.energy.push_array(energies)
+        self.order.push_array(orders)
+        self.tau.push_array(taus)
+        order_histogram = np.bincount(orders, minlength=len(self.order_histogram))
+        order_histogram[:len(self.order_histogram)] += self.order_histogram
+        self.order_histogram = order_histogram
+        tau_bins = np.minimum((taus/self.tau_bin_width).astype(np.int64),
+                              len(self.tau_histogram) - 1)
+        self.tau_histogram += np.bincount(tau_bins, minlength=len(self.tau_histogram))
+
+    def merge(self, other):
+        """Add the samples of an accumulator with the same tau binning"""
+        self.energy.merge(other.energy)
+        self.order.merge(other.order)
+        self.tau.merge(other.tau)
+        size = max(len(self.order_histogram), len(other.order_histogram))
+        order_histogram = np.zeros(size, dtype=np.int64)
+        order_histogram[:len(self.order_histogram)] += self.order_histogram
+        order_histogram[:len(other.order_histogram)] += other.order_histogram
+        self.order_histogram = order_histogram
+        self.tau_histogram += other.tau_histogram
+
+    def get_state(self) -> dict :
+        """Content of the accumulator as a dictionary of arrays"""
+        return {'energy': self.energy.get_state(),
+                'order': self.order.get_state(),
+                'tau': self.tau.get_state(),
+                'order_histogram': self.order_histogram,
+                'tau_edges': self.tau_edges,
+                'tau_histogram': self.tau_histogram}
+
+    def set_state(self, state : dict):
+        """Restore a state returned by get_state"""
+        self.energy.set_state(state['energy'])
+        self.order.set_state(state['order'])
+        self.tau.set_state(state['tau'])
+        self.order_histogram = np.array(state['order_histogram'], dtype=np.int64)
+        self.tau_edges = np.array(state['tau_edges'], dtype=np.float64)
+        self.tau_histogram = np.array(state['tau_histogram'], dtype=np.int64)
+        self.tau_bin_width = self.tau_edges[1] - self.tau_edges[0]
+
+    def max_order(self) -> int :
+        """Highest diagram order sampled"""
+        return int(np.flatnonzero(self.order_histogram)[-1])
+
+MIN_BLOCKS = 32
+
+class BlockingAccumulator:
+    """Logarithmic blocking analysis of a correlated time series
+    (Flyvbjerg and Petersen, J. Chem. Phys. 91, 461 (1989)).
+    Level k holds count, sum and sum of squares of the means of blocks of
+    2**k consecutive samples, a block is formed as soon as its two halves
+    are available so that each push costs O(1) amortized"""
+    def __init__(self):
+        self.counts = []
+        self.sums = []
+        self.sumsqs = []
+        self.pending = []
+
+    def push(self, value : float):
+        """Fold a sample at level 0 and propagate the completed blocks"""
+        level = 0
+        while True:
+            if level == len(self.counts):
+                self.counts.append(0)
+                self.sums.append(0.0)
+                self.sumsqs.append(0.0)
+                self.pending.append(None)
+            self.counts[level] += 1
+            self.sums[level] += value
+            self.sumsqs[level] += value*value
+            if self.pending[level] is None:
+                self.pending[level] = value
+                return
+            value = 0.5*(self.pending[level] + value)
+            self.pending[level] = None
+            level += 1
+
+    def merge(self, other):
+        """Add the blocks of an independent chain, blocks are never formed
+        across the two series"""
+        for level in range(len(other.counts)):
+            if level == len(self.counts):
+                self.counts.append(0)
+                self.sums.append(0.0)
+                self.sumsqs.append(0.0)
+                self.pending.append(None)
+            self.counts[level] += other.counts[level]
+            self.sums[level] += other.sums[level]
+            self.sumsqs[level] += other.sumsqs[level]
+        self.pending = [None]*len(self.counts)
+
+    def get_state(self) -> dict :
+        """Content of the levels as a dictionary of arrays, a missing
+        pending value is stored as nan"""
+        return {'counts': np.array(self.counts, dtype=np.int64),
+                'sums': np.array(self.sums, dtype=np.float64),
+                'sumsqs': np.array(self.sumsqs, dtype=np.float64),
+                'pending': np.array([np.nan if value is None else value
+                                     for value in self.pending], dtype=np.float64)}
+
+    def set_state(self, state : dict):
+        """Restore a state returned by get_state"""
+        self.counts = state['counts'].tolist()
+        self.sums = state['sums'].tolist()
+        self.sumsqs = state['sumsqs'].tolist()
+        self.pending = [None if np.isnan(value) else value
+                        for value in state['pending'].tolist()]
+
+    def mean(self) -> float :
+        """Mean of the samples"""
+        if not self.counts:
+            return 0.0
+        return self.sums[0]/self.counts[0]
+
+    def level_errors(self) -> np.ndarray :
+        """Standard error of the mean estimated at each blocking level with
+        at least MIN_BLOCKS blocks"""
+        errors = []
+        for count, total, sumsq in zip(self.counts, self.sums, self.sumsqs):
+            if count < MIN_BLOCKS:
+                break
+            variance = max(sumsq - total*total/count, 0.0)/(count - 1)
+            errors.append(np.sqrt(variance/count))
+        return np.array(errors)
+
+    def standard_error(self) -> float :
+        """Largest error among the reliable levels. For correlated samples
+        the estimate grows with the block size until the blocks become
+        independent and then stays on a plateau, is_converged tells
+        whether it was reached"""
+        errors = self.level_errors()
+        if len(errors) == 0:
+            return np.nan
+        return float(np.max(errors))
+
+    def is_converged(self) -> bool :
+        """True if the error estimates of the two largest reliable levels
+        agree within their own uncertainty, error/sqrt(2*(blocks - 1)).
+        Otherwise the blocks are still shorter than the autocorrelation
+        time, and standard_error, autocorrelation_time and
+        effective_samples underestimate the correlations"""
+        errors = self.level_errors()
+        if len(errors) < 2:
+            return False
+        counts = np.array(self.counts[len(errors) - 2:len(errors)], dtype=np.float64)
+        uncertainties = errors[-2:]/np.sqrt(2*(counts - 1))
+        return bool(errors[-1] - errors[-2] <= np.sqrt(np.sum(uncertainties**2)))
+
+    def autocorrelation_time(self) -> float :
+        """Integrated autocorrelation time in units of steps, defined by
+        error**2 = naive_error**2 * 2 * tau_int"""
+        errors = self.level_errors()
+        if len(errors) == 0 or errors[0] == 0:
+            return np.nan
+        return float(0.5*(np.max(errors)/errors[0])**2)
+
+    def effective_samples(self) -> float :
+        """Number of independent samples equivalent to the correlated ones"""
+        tau_int = self.autocorrelation_time()
+        if np.isnan(tau_int):
+            return np.nan
+        return self.counts[0]/(2*tau_int)
+
+class GreenFunctionAccumulator:
+    """Estimator of the Green's function G(tau) of the polaron on fixed bins
+    of [0, max_time]. The lifetimes are counted in batches of batch_size
+    samples, the spread of the batch histograms gives the error of each bin
+    (batch means). The zero order samples are counted apart and fix the
+    normalization, since the bare propagator G0(tau) = exp(-mu*tau) is known"""
+    def __init__(self, max_time : float, mu : float, tau_bins : int = 50,
+                 batch_size : int = 1000):
+        self.mu = mu
+        self.edges = np.linspace(0, max_time, tau_bins + 1)
+        self.bin_width = max_time/tau_bins
+        self.batch_size = batch_size
+        self.histogram = np.zeros(tau_bins, dtype=np.int64)
+        self.sums = np.zeros(tau_bins, dtype=np.float64)
+        self.sumsqs = np.zeros(tau_bins, dtype=np.float64)
+        self.batches = 0
+        self.zero_order = 0
+        self.batch = [0]*tau_bins
+        self.batch_count = 0
+
+    def push(self, order : int, tau : float):
+        """Count the lifetime of the current diagram in its bin"""
+        self.batch[min(int(tau/self.bin_width), len(self.batch) - 1)] += 1
+        if order == 0:
+            self.zero_order += 1
+        self.batch_count += 1
+        if self.batch_count == self.batch_size:
+            self.fold_batch()
+
+    def push_arrays(self, orders : np.ndarray, taus : np.ndarray):
+        """Count chunks of samples at once, the batches are formed as if the
+        samples were pushed one by one"""
+        tau_bins = np.minimum((taus/self.bin_width).astype(np.int64), len(self.batch) - 1)
+        self.zero_order += int(np.count_nonzero(orders == 0))
+        start = 0
+        while start < len(tau_bins):
+            stop = min(start + self.batch_size - self.batch_count, len(tau_bins))
+            counts = np.bincount(tau_bins[start:stop], minlength=len(self.batch))
+            self.batch = (np.array(self.batch) + counts).tolist()
+            self.batch_count += stop - start
+            if self.batch_count == self.batch_size:
+                self.fold_batch()
+            start = stop
+
+    def fold_batch(self):
+        """Add the completed batch to the histogram and to the batch means"""
+        batch = np.array(self.batch, dtype=np.int64)
+        self.histogram += batch
+        self.sums += batch
+        self.sumsqs += batch.astype(np.float64)**2
+        self.batches += 1
+        self.batch = [0]*len(self.batch)
+        self.batch_count = 0
+
+    def samples(self) -> int :
+        return int(self.histogram.sum()) + self.batch_count
+
+    def merge(self, other):
+        """Add the samples of an independent chain with the same binning,
+        its incomplete batch is counted in the histogram only"""
+        self.histogram += other.histogram + np.array(other.batch, dtype=np.int64)
+        self.sums += other.sums
+        self.sumsqs += other.sumsqs
+        self.batches += other.batches
+        self.zero_order += other.zero_order
+
+    def get_state(self) -> dict :
+        """Content of the accumulator as a dictionary of arrays"""
+        return {'mu': np.array(self.mu),
+                'edges': self.edges,
+                'batch_size': np.array(self.batch_size),
+                'histogram': self.histogram,
+                'sums': self.sums,
+                'sumsqs': self.sumsqs,
+                'batches': np.array(self.batches),
+                'zero_order': np.array(self.zero_order),
+                'batch': np.array(self.batch, dtype=np.int64),
+                'batch_count': np.array(self.batch_count)}
+
+    def set_state(self, state : dict):
+        """Restore a state returned by get_state"""
+        self.mu = float(state['mu'])
+        self.edges = np.array(state['edges'], dtype=np.float64)
+        self.bin_width = self.edges[1] - self.edges[0]
+        self.batch_size = int(state['batch_size'])
+        self.histogram = np.array(state['histogram'], dtype=np.int64)
+        self.sums = np.array(state['sums'], dtype=np.float64)
+        self.sumsqs = np.array(state['sumsqs'], dtype=np.float64)
+        self.batches = int(state['batches'])
+        self.zero_order = int(state['zero_order'])
+        self.batch = state['batch'].tolist()
+        self.batch_count = int(state['batch_count'])
+
+    def normalization(self) -> float :
+        """Factor from the density of sampled lifetimes to G(tau). The zero
+        order diagrams are sampled with weight G0, so the fraction of zero
+        order samples is the integral of G0 over the integral of G"""
+        if self.zero_order == 0:
+            return np.nan
+        max_time = self.edges[-1]
+        if self.mu == 0:
+            integral = max_time
+        else:
+            integral = -np.expm1(-self.mu*max_time)/self.mu
+        return integral*self.samples()/self.zero_order
+
+    def green_function(self) -> tuple :
+        """G(tau) at the bin centers and its batch means error, the error of
+        the normalization is not included"""
+        samples = self.samples()
+        factor = self.normalization()/self.bin_width
+        green = factor*(self.histogram + np.array(self.batch))/max(samples, 1)
+        errors = np.full(len(green), np.nan)
+        if self.batches > 1:
+            mean = self.sums/self.batches
+            variance = np.maximum(self.sumsqs/self.batches - mean**2, 0.0) * \
+                self.batches/(self.batches - 1)
+            errors = factor*np.sqrt(variance/self.batches)/self.batch_size
+        return 0.5*(self.edges[1:] + self.edges[:-1]), green, errors
+
+    def fit_exponential_tail(self, fit_start : float = None) -> dict :
+        """Weighted least squares fit of log G(tau) = log Z - E*tau over the
+        bins with tau >= fit_start (half of the range by default).
+        Return the ground state energy E and the Z factor with their errors,
+        nan if fewer than three bins can be used"""
+        if fit_start is None:
+            fit_start = 0.5*self.edges[-1]
+        taus, green, errors = self.green_function()
+        used = (taus >= fit_start) & (green > 0) & (errors > 0)
+        result = {'Energy': np.nan, 'Energy_error': np.nan, 'Z': np.nan, 'Z_error': np.nan,
+                  'Fit_start': fit_start, 'Bins': int(np.count_nonzero(used))}
+        if result['Bins'] < 3:
+            return result
+        weights = green[used]/errors[used]
+        design = np.column_stack((np.ones(result['Bins']), taus[used]))*weights[:, None]
+        coefficients = np.linalg.lstsq(design, np.log(green[used])*weights, rcond=None)[0]
+        covariance = np.linalg.inv(design.T @ design)
+        result['Energy'] = float(-coefficients[1])
+        result['Energy_error'] = float(np.sqrt(covariance[1, 1]))
+        result['Z'] = float(np.exp(coefficients[0]))
+        result['Z_error'] = float(result['Z']*np.sqrt(covariance[0, 0]))
+        return result
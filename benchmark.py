@@ -0,0 +1,190 @@
+"""Benchmark of the diagrammatic MonteCarlo. The update kernels of Polaron are
+timed at controlled diagram orders and coupling strengths, then the whole
+chain throughput of the engines is measured. Results are written as JSON and
+compared with a stored baseline to flag throughput regressions.
+
+Example:
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+import numpy as np
+from montecarlo_parser import MonteCarloParser
+from polaron import Polaron
+from dmc import run_diagrammatic_montecarlo
+
+KERNELS = ('eval_add_internal', 'eval_remove_internal', 'eval_change_tau',
+           'eval_shift_vertex', 'eval_diagram_energy')
+
+def get_args(g : float, nsteps : int = 10000, seed : int = 0) -> argparse.Namespace :
+    """Default simulation parameters with the given coupling"""
+    args = MonteCarloParser().parser.parse_args([])
+    args.g = g
+    args.nsteps = nsteps
+    args.seed = seed
+    args.accumulate = True
+    return args
+
+def build_polaron(order : int, g : float, shift_weight : float = 0.0) -> Polaron :
+    """Polaron whose diagram holds order random phonons, the vertex_times
+    of the shift update are kept if shift_weight is positive"""
+    args = get_args(g)
+    args.shift_weight = shift_weight
+    polaron = Polaron(args)
+    for _ in range(order):
+        polaron.add_internal(polaron.generate_phonon())
+    return polaron
+
+def time_kernel(kernel : str, order : int, g : float, calls : int) -> float :
+    """Calls per second of a Polaron update kernel at the requested order.
+    Each call is timed on its own and the diagram is restored after it, out
+    of the timed region, so that the order never drifts. The energy cache is
+    invalidated before each call of eval_diagram_energy. The cost of reading
+    the clock twice is subtracted"""
+    polaron = build_polaron(order, g, 1.0 if kernel == 'eval_shift_vertex' else 0.0)
+    state = polaron.get_diagram_state()
+    method = getattr(polaron, kernel)
+    overhead = min(-time.perf_counter() + time.perf_counter() for _ in range(1000))
+    elapsed = 0.0
+    for _ in range(calls):
+        polaron.diagram['energy_outdated'] = True
+        start = time.perf_counter()
+        method()
+        elapsed += time.perf_counter() - start - overhead
+        polaron.set_diagram_state(state)
+    return calls/elapsed
+
+def time_python_engine(g : float, nsteps : int) -> float :
+    """Steps per second of run_diagrammatic_montecarlo"""
+    args = get_args(g, nsteps)
+    polaron = Polaron(args)
+    start = time.perf_counter()
+    run_diagrammatic_montecarlo(polaron, args)
+    return nsteps/(time.perf_counter() - start)
+
+def time_numba_engine(g : float, nsteps : int) -> float :
+    """Steps per second of the compiled chain, compilation excluded"""
+    from numba_polaron import NumbaPolaron, montecarlo_accumulate
+    args = get_args(g, nsteps)
+    polaron = NumbaPolaron(args.order, args.omega, args.mu, args.g,
+                           args.time_scaling, args.max_time)
+    montecarlo_accumulate(polaron, 1, 10, args.tau_bins, args.green_batch)
+    start = time.perf_counter()
+    montecarlo_accumulate(polaron, 1, nsteps, args.tau_bins, args.green_batch)
+    return nsteps/(time.perf_counter() - start)
+
+def time_ensemble_engine(g : float, nsteps : int) -> float :
+    """Diagram updates per second of the ensemble engine, nsteps updates
+    shared by the walkers"""
+    from ensemble_polaron import run_ensemble_montecarlo
+    args = get_args(g, nsteps)
+    args.nsteps = max(nsteps//args.nwalkers, 1)
+    args.nsteps_burn = 1
+    start = time.perf_counter()
+    run_ensemble_montecarlo(args, np.random.SeedSequence(args.seed))
+    return args.nsteps*args.nwalkers/(time.perf_counter() - start)
+
+def time_numba_tutorial(nsteps : int) -> float :
+    """Steps per second of the jitclass Distribution of NumbaTutorial, the
+    reference for the throughput of a compiled single variable chain"""
+    from numba import njit
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'NumbaTutorial', 'distribution.py')
+    spec = importlib.util.spec_from_file_location('numba_tutorial_distribution', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    @njit
+    def montecarlo(dist, steps):
+        for _ in range(1, steps):
+            dist.eval_change_tau()
+        return dist
+
+    montecarlo(module.Distribution(5), 10)
+    start = time.perf_counter()
+    montecarlo(module.Distribution(5), nsteps)
+    return nsteps/(time.perf_counter() - start)
+
+def numba_available() -> bool :
+    return importlib.util.find_spec('numba') is not None
+
+def run_benchmark(args : argparse.Namespace) -> dict :
+    results = {'python': sys.version.split()[0], 'kernels': [], 'throughput': []}
+    for g in args.couplings:
+        for order in args.orders:
+            for kernel in KERNELS:
+                if kernel in ('eval_remove_internal', 'eval_shift_vertex') and order == 0:
+                    continue
+                rate = time_kernel(kernel, order, g, args.calls)
+                results['kernels'].append({'kernel': kernel, 'order': order, 'g': g,
+                                           'calls_per_second': rate})
+                print(f"{kernel:<22} order={order:<5} g={g:<5} {rate:14.0f} calls/s")
+        engines = {'python': time_python_engine, 'ensemble': time_ensemble_engine}
+        if numba_available():
+            engines['numba'] = time_numba_engine
+        for engine, timer in engines.items():
+            rate = timer(g, args.nsteps)
+            results['throughput'].append({'engine': engine, 'g': g,
+                                          'steps_per_second': rate})
+            print(f"{engine + ' engine':<22} g={g:<5} {rate:25.0f} steps/s")
+    if numba_available():
+        rate = time_numba_tutorial(args.nsteps)
+        results['throughput'].append({'engine': 'numba_tutorial', 'g': None,
+                                      'steps_per_second': rate})
+        print(f"{'NumbaTutorial':<22} {rate:33.0f} steps/s")
+    return results
+
+def get_rates(results : dict) -> dict :
+    """Flatten the results in a dictionary from benchmark name to rate"""
+    rates = {f"{entry['kernel']}[order={entry['order']},g={entry['g']}]":
+             entry['calls_per_second'] for entry in results['kernels']}
+    rates.update({f"{entry['engine']}[g={entry['g']}]": entry['steps_per_second']
+                  for entry in results['throughput']})
+    return rates
+
+def find_regressions(results : dict, baseline : dict, tolerance : float) -> list :
+    """Benchmarks whose rate dropped by more than tolerance with respect to
+    the baseline, as (name, baseline rate, current rate)"""
+    rates = get_rates(results)
+    return [(name, rate, rates[name]) for name, rate in get_rates(baseline).items()
+            if name in rates and rates[name] < (1 - tolerance)*rate]
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark of the DMC update kernels "
+                                     "and of the whole chain throughput")
+    parser.add_argument('--orders', dest='orders', type=int, nargs='+',
+                        default=[0, 10, 100], help="Diagram orders of the kernel benchmarks")
+    parser.add_argument('--couplings', dest='couplings', type=float, nargs='+',
+                        default=[0.3, 1.0, 2.0], help="Electron phonon couplings")
+    parser.add_argument('--calls', dest='calls', type=int, default=20000,
+                        help="Calls of each kernel")
+    parser.add_argument('--nsteps', dest='nsteps', type=int, default=100000,
+                        help="MonteCarlo steps of the throughput benchmarks")
+    parser.add_argument('--output', dest='output', type=str, default='benchmark.json',
+                        help="Path of the JSON results")
+    parser.add_argument('--baseline', dest='baseline', type=str, default=None,
+                        help="JSON results to compare with")
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.1,
+                        help="Relative drop of a rate flagged as a regression")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    results = run_benchmark(args)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for name, baseline_rate, rate in regressions:
+            print(f"Regression in {name}: {rate:.0f}/s against {baseline_rate:.0f}/s")
+        if regressions:
+            sys.exit(1)
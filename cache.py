@@ -0,0 +1,80 @@
+"""Local cache of finished Markov chains. A chain is stored as a checkpoint
+named after the hash of the arguments that determine it, seed included, so
+a later run with the same arguments reads the result instead of repeating
+thermalization and sampling. A run with more --nsteps restarts the cached
+chain from its last step and only performs the missing ones. The size of
+the cache is bounded, the least recently used chains are evicted first."""
+
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+from polaron import Polaron
+from random_source import RandomSource
+from checkpoint import PARAMETERS, load_checkpoint, save_checkpoint
+from dmc import run_diagrammatic_montecarlo, run_thermalization_steps
+from status import StatusWriter
+
+KEY_ARGUMENTS = PARAMETERS + ('seed', 'order', 'time_scaling', 'nsteps_burn', 'accumulate',
+                              'tau_bins', 'green_batch', 'adaptive_burn',
+                              'burn_window', 'window_tau', 'drift_windows', 'drift_threshold',
+                              'target_acceptance', 'shift_weight')
+
+def cache_key(args : argparse.Namespace, chain : int) -> str :
+    """Hash of the arguments that determine the chain, the number of
+    sampling steps excluded"""
+    arguments = {name: getattr(args, name, None) for name in KEY_ARGUMENTS}
+    arguments['chain'] = chain
+    return hashlib.sha256(json.dumps(arguments, sort_keys=True).encode()).hexdigest()
+
+def evict(cache_dir : str, max_bytes : float, keep : str):
+    """Remove the least recently used chains until the cache holds at most
+    max_bytes, the chain in keep is never removed. The chains of parallel
+    workers may evict at the same time: the .tmp.npz files that are still
+    being written are skipped and entries removed meanwhile are ignored"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.npz') or name.endswith('.tmp.npz'):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if path != keep:
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def run_cached_chain(args : argparse.Namespace, seed_sequence : np.random.SeedSequence,
+                     chain : int = 0, status : StatusWriter = None) -> dict :
+    """Run a chain through the cache in args.cache_dir. A cached chain with
+    at least args.nsteps steps is returned as it is, a shorter one is
+    extended, otherwise the chain is run from scratch. The chain is then
+    stored and the cache trimmed to args.cache_size megabytes. The progress
+    is reported to status if given"""
+    os.makedirs(args.cache_dir, exist_ok=True)
+    path = os.path.join(args.cache_dir, cache_key(args, chain) + '.npz')
+    if os.path.exists(path):
+        polaron, first_step = load_checkpoint(path, args)
+        os.utime(path)
+        if first_step >= args.nsteps:
+            return polaron.diagrams_info
+    else:
+        polaron = Polaron(args, RandomSource(seed_sequence))
+        polaron = run_thermalization_steps(polaron, args, status)
+        polaron.update_diagrams_info()
+        first_step = 1
+    diagrams_info = run_diagrammatic_montecarlo(polaron, args, first_step, status=status)
+    save_checkpoint(path, polaron, args, max(first_step, args.nsteps))
+    evict(args.cache_dir, args.cache_size*2**20, path)
+    return diagrams_info
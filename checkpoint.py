@@ -0,0 +1,103 @@
+"""Helper functions that save the state of a running Markov chain to a
+compact binary file (numpy .npz) and restore it. A checkpoint holds the
+current diagram, the statistics accumulated so far and the state of the
+random source, so that a resumed run continues the same chain exactly."""
+
+import argparse
+import os
+import numpy as np
+from polaron import Polaron
+from accumulators import BlockingAccumulator, GreenFunctionAccumulator, StreamingAccumulator
+
+PARAMETERS = ('omega', 'mu', 'g', 'max_time')
+COUNTERS = ('Proposed', 'Accepted', 'Rejected', 'Extreme', 'Timed', 'Time')
+
+def checkpoint_path(path : str, chain : int, nchains : int) -> str :
+    """Path of the checkpoint of a chain, when several chains run together
+    the chain index is added before the extension"""
+    if nchains == 1:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.chain{chain}{extension}"
+
+def prefix_state(prefix : str, state : dict) -> dict :
+    return {f"{prefix}_{key}": value for key, value in state.items()}
+
+def unprefix_state(prefix : str, state) -> dict :
+    start = len(prefix) + 1
+    return {key[start:]: state[key] for key in state.keys() if key.startswith(prefix + '_')}
+
+def get_diagrams_info_state(diagrams_info : dict) -> dict :
+    """Flatten diagrams_info in a dictionary of arrays"""
+    state = {}
+    if 'Accumulator' in diagrams_info:
+        state.update(prefix_state('accumulator', diagrams_info['Accumulator'].get_state()))
+    else:
+        state['order_sequence'] = np.array(diagrams_info['Order_sequence'], dtype=np.int64)
+        state['energy_sequence'] = np.array(diagrams_info['Energy_sequence'],
+                                            dtype=np.float64)
+    for name, accumulator in diagrams_info['Blocking'].items():
+        state.update(prefix_state(f'blocking_{name}', accumulator.get_state()))
+    state.update(prefix_state('green', diagrams_info['Green'].get_state()))
+    state['update_names'] = np.array(list(diagrams_info['Updates']))
+    state['update_counters'] = np.array([[counters[key] for key in COUNTERS]
+                                         for counters in diagrams_info['Updates'].values()],
+                                        dtype=np.float64)
+    return state
+
+def set_diagrams_info_state(diagrams_info : dict, state : dict):
+    """Fill diagrams_info with the arrays stored by get_diagrams_info_state"""
+    if 'accumulator_tau_edges' in state:
+        accumulator = StreamingAccumulator(1.0)
+        accumulator.set_state(unprefix_state('accumulator', state))
+        diagrams_info['Accumulator'] = accumulator
+        for key in ('Order_sequence', 'Energy_sequence'):
+            diagrams_info.pop(key, None)
+    else:
+        diagrams_info.pop('Accumulator', None)
+        diagrams_info['Order_sequence'] = state['order_sequence'].tolist()
+        diagrams_info['Energy_sequence'] = state['energy_sequence'].tolist()
+    for name in diagrams_info['Blocking']:
+        accumulator = BlockingAccumulator()
+        accumulator.set_state(unprefix_state(f'blocking_{name}', state))
+        diagrams_info['Blocking'][name] = accumulator
+    green = GreenFunctionAccumulator(1.0, 0.0)
+    green.set_state(unprefix_state('green', state))
+    diagrams_info['Green'] = green
+    diagrams_info['Updates'] = {str(name): {key: type(default)(value) for key, default, value
+                                            in zip(COUNTERS, (0, 0, 0, 0, 0, 0.0), row)}
+                                for name, row in zip(state['update_names'],
+                                                     state['update_counters'])}
+
+def save_checkpoint(path : str, polaron : Polaron, args : argparse.Namespace,
+                    next_step : int):
+    """Write the state of the chain, next_step is the first sampling step
+    still to be performed. The file is written aside and then moved so that
+    an interrupted write never corrupts the previous checkpoint.
+    The traces, if any, are flushed so that they hold every sample counted
+    in the checkpoint"""
+    if 'Trace' in polaron.diagrams_info:
+        polaron.diagrams_info['Trace'].flush()
+    state = {'next_step': np.array(next_step)}
+    state.update({f'parameter_{name}': np.array(getattr(args, name))
+                  for name in PARAMETERS})
+    state.update(prefix_state('diagram', polaron.get_diagram_state()))
+    state.update(prefix_state('info', get_diagrams_info_state(polaron.diagrams_info)))
+    state.update(prefix_state('random', polaron.random_source.get_state()))
+    temporary_path = path + '.tmp.npz'
+    np.savez(temporary_path, **state)
+    os.replace(temporary_path, path)
+
+def load_checkpoint(path : str, args : argparse.Namespace) -> tuple :
+    """Rebuild the Polaron stored in a checkpoint.
+    Return the polaron and the first sampling step still to be performed"""
+    with np.load(path) as data:
+        for name in PARAMETERS:
+            if data[f'parameter_{name}'] != getattr(args, name):
+                raise ValueError(f"Checkpoint {path} was written with {name}="
+                                 f"{data[f'parameter_{name}']}, not {getattr(args, name)}")
+        polaron = Polaron(args)
+        polaron.set_diagram_state(unprefix_state('diagram', data))
+        set_diagrams_info_state(polaron.diagrams_info, unprefix_state('info', data))
+        polaron.random_source.set_state(unprefix_state('random', data))
+        return polaron, int(data['next_step'])
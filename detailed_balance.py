@@ -0,0 +1,110 @@
+"""Consistency checks of the add and remove updates of the Holstein polaron.
+Detailed balance between add and remove holds only if the phonons are
+proposed from the density that the acceptance ratios divide by, so two
+checks are performed:
+
+- the removal times drawn by Polaron.generate_phonon are mapped through the
+  cumulative distribution of the truncated exponential of
+  log_removal_time_prob, which must give uniform values, tested with the
+  Kolmogorov-Smirnov statistic at several lifetimes;
+- a chain is run and its mean order and lifetime are compared with the
+  exact atomic limit, where the diagrams of order n at lifetime tau sum to
+  exp(-mu*tau)*A(tau)**n/n! with A(tau) = (g/omega)**2*(omega*tau - 1 + exp(-omega*tau)).
+
+Example:
+    python detailed_balance.py --g 0.5 --nsteps 1000000 --seed 1
+"""
+
+import argparse
+import math
+import sys
+import numpy as np
+from montecarlo_parser import MonteCarloParser
+from polaron import Polaron
+from random_source import RandomSource
+from dmc import run_diagrammatic_montecarlo, run_thermalization_steps
+from parallel import spawn_seeds
+
+"""Kolmogorov-Smirnov critical value at 1% significance, times sqrt(n)"""
+KS_CRITICAL = 1.63
+"""Largest deviation from the exact means in standard errors"""
+Z_THRESHOLD = 4.0
+
+def removal_time_cdf(alpha : np.ndarray, t_gen : np.ndarray, t_rem : np.ndarray) -> np.ndarray :
+    """Cumulative distribution of the removal time given the generation
+    time for the density exp(log_removal_time_prob)"""
+    return np.expm1(-alpha*(t_rem - t_gen))/np.expm1(-alpha*(1 - t_gen))
+
+def check_proposal(polaron : Polaron, taus : list, nsamples : int) -> list :
+    """Kolmogorov-Smirnov statistic of the removal times proposed at each
+    lifetime in taus, scaled by sqrt(nsamples) so that it stays below
+    KS_CRITICAL if the proposal follows the density of the ratios"""
+    time_scaling = polaron.diagram['time_scaling']
+    statistics = []
+    for tau in taus:
+        polaron.diagram['time_scaling'] = tau
+        phonons = [polaron.generate_phonon() for _ in range(nsamples)]
+        t_gen = np.array([phonon['gen_time'] for phonon in phonons])
+        t_rem = np.array([phonon['rem_time'] for phonon in phonons])
+        alpha = polaron.diagram['phonon_energy']*tau
+        values = np.sort(removal_time_cdf(alpha, t_gen, t_rem))
+        ranks = np.arange(1, nsamples + 1)/nsamples
+        distance = max(np.max(ranks - values), np.max(values - ranks + 1/nsamples))
+        statistics.append(float(distance*math.sqrt(nsamples)))
+    polaron.diagram['time_scaling'] = time_scaling
+    return statistics
+
+def exact_means(args : argparse.Namespace, npoints : int = 20001) -> dict :
+    """Mean order and lifetime of the atomic limit with lifetimes up to
+    args.max_time, integrated on a grid of npoints lifetimes"""
+    taus = np.linspace(0, args.max_time, npoints)
+    amplitude = (args.g/args.omega)**2 * \
+        (args.omega*taus + np.expm1(-args.omega*taus))
+    """Summed over the orders the weight is exp(-mu*tau + A), the mean order
+    at fixed tau is A"""
+    log_weights = -args.mu*taus + amplitude
+    weights = np.exp(log_weights - np.max(log_weights))
+    normalization = np.trapezoid(weights, taus)
+    return {'Order': float(np.trapezoid(amplitude*weights, taus)/normalization),
+            'Tau': float(np.trapezoid(taus*weights, taus)/normalization)}
+
+def check_sampling(args : argparse.Namespace, polaron : Polaron) -> dict :
+    """Run the chain and return, for order and lifetime, the sampled mean,
+    its blocking error, the exact mean and their distance in errors"""
+    polaron = run_thermalization_steps(polaron, args)
+    polaron.update_diagrams_info()
+    blocking = run_diagrammatic_montecarlo(polaron, args)['Blocking']
+    exact = exact_means(args)
+    results = {}
+    for name, value in exact.items():
+        mean = blocking[name].mean()
+        error = blocking[name].standard_error()
+        results[name] = {'Mean': mean, 'Error': error, 'Exact': value,
+                         'Z': (mean - value)/error}
+    return results
+
+if __name__ == "__main__":
+
+    mc_parser = MonteCarloParser()
+    mc_parser.parser.add_argument('--proposal-samples', dest='proposal_samples', type=int,
+                        default=20000, help="Phonons drawn at each lifetime of the "
+                        "proposal check")
+    mc_parser.parser.add_argument('--taus', dest='taus', type=float, nargs='+',
+                        default=[0.1, 1.0, 10.0, 50.0], help="Lifetimes of the proposal check")
+    args = mc_parser.parser.parse_args()
+    args.accumulate = True
+
+    polaron = Polaron(args, RandomSource(spawn_seeds(args.seed, 1)[0]))
+    passed = True
+    print(f"{'tau':>8} {'KS statistic':>14}")
+    for tau, statistic in zip(args.taus, check_proposal(polaron, args.taus,
+                                                        args.proposal_samples)):
+        passed = passed and statistic < KS_CRITICAL
+        print(f"{tau:>8.4g} {statistic:>14.3f}")
+    print(f"{'':<8} {'Sampled':>12} {'Error':>10} {'Exact':>12} {'Deviation':>10}")
+    for name, result in check_sampling(args, polaron).items():
+        passed = passed and abs(result['Z']) < Z_THRESHOLD
+        print(f"{name:<8} {result['Mean']:>12.5f} {result['Error']:>10.2e} "
+              f"{result['Exact']:>12.5f} {result['Z']:>10.2f}")
+    print("Detailed balance check " + ("passed" if passed else "failed"))
+    sys.exit(0 if passed else 1)
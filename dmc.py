@@ -2,44 +2,227 @@
 Holstein polaron. """
 
 import argparse
-import random
+import math
+import time
+import numpy as np
 from polaron import Polaron
+from accumulators import BlockingAccumulator
+from checkpoint import save_checkpoint
+from status import StatusWriter
 
-def run_thermalization_steps(polaron : Polaron, args : argparse.Namespace) -> Polaron :
+def eval_update(polaron : Polaron, timed : bool = False):
+    """Perform one of the updates allowed for the current diagram, chosen
+    according to the update weights of the polaron, and record its outcome
+    in diagrams_info['Updates'].
+    If timed is True the wall time of the update is added to its counters.
+    choose_update never draws an update that needs a phonon for a zero
+    order diagram, so an exception here is a bug and is not caught"""
+    update = polaron.choose_update()
+    counters = polaron.diagrams_info['Updates'][update.__name__]
+    counters['Proposed'] += 1
+    if timed:
+        start = time.perf_counter()
+        accepted = update()
+        counters['Time'] += time.perf_counter() - start
+        counters['Timed'] += 1
+    else:
+        accepted = update()
+    if accepted:
+        counters['Accepted'] += 1
+    else:
+        counters['Rejected'] += 1
+
+def is_timed(step : int, args : argparse.Namespace) -> bool :
+    """Updates are timed once every args.timing_every steps"""
+    return args.timing_every > 0 and step % args.timing_every == 0
+
+def run_thermalization_steps(polaron : Polaron, args : argparse.Namespace,
+                             status : StatusWriter = None) -> Polaron :
     """Input parameter:
     - args : list that contains the fundamental parameters for the simulation
+    - status : if given the progress is reported there every status.every steps
+    With args.adaptive_burn the thermalization stops on its own, see
+    run_adaptive_thermalization
     """
-    for _ in range(1, args.nsteps_burn):
-        try:
-            if polaron.diagram['order'] == 0:
-                number = random.randrange(len(polaron.zero_order_updates))
-                polaron.zero_order_updates[number]()
-            else:
-                number = random.randrange(len(polaron.updates))
-                polaron.updates[number]()
-        except Exception as error:
-            print(f"Invalid step in DMC, {error}, {error.__class__}")
-            polaron.diagrams_info['Invalid_diagrams'] += 1
-            continue
+    if args.adaptive_burn:
+        return run_adaptive_thermalization(polaron, args, status)
+    for step in range(1, args.nsteps_burn):
+        eval_update(polaron, is_timed(step, args))
+        if status is not None and step % status.every == 0:
+            status.write(polaron, 'thermalization', step, args.nsteps_burn)
     return polaron
 
-def run_diagrammatic_montecarlo(polaron : Polaron, args : argparse.Namespace) -> dict :
+def get_acceptances(updates : dict) -> dict :
+    """Accepted and proposed steps of each update so far"""
+    return {name: (counters['Accepted'], counters['Proposed'])
+            for name, counters in updates.items()}
+
+def eval_window_acceptance(before : dict, after : dict, name : str) -> float :
+    """Acceptance rate of an update between two calls of get_acceptances,
+    nan if it was never proposed"""
+    proposed = after[name][1] - before[name][1]
+    if proposed == 0:
+        return math.nan
+    return (after[name][0] - before[name][0])/proposed
+
+def group_means(means : list, group : int) -> np.ndarray :
+    """Means of consecutive groups of group entries of means, aligned to
+    the most recent entry"""
+    ngroups = len(means)//group
+    return np.mean(np.array(means[len(means) - ngroups*group:]).reshape(ngroups, group), axis=1)
+
+def is_stationary(window_means : list, nwindows : int, threshold : float,
+                  group : int = 1) -> bool :
+    """Drift test on the last 2*nwindows windows, each made of group
+    consecutive entries of window_means. The series is stationary if the
+    difference between the average of the older and of the newer half is
+    within threshold standard errors"""
+    if len(window_means) < 2*nwindows*group:
+        return False
+    means = group_means(window_means, group)
+    older = means[-2*nwindows:-nwindows]
+    newer = means[-nwindows:]
+    error = np.sqrt((np.var(older, ddof=1) + np.var(newer, ddof=1))/nwindows)
+    drift = abs(np.mean(newer) - np.mean(older))
+    return drift <= threshold*error or drift == 0
+
+def get_window_group(blockings : list, args : argparse.Namespace) -> int :
+    """Number of windows of args.burn_window steps that make a window of
+    the drift test, at least args.window_tau times the largest integrated
+    autocorrelation time estimated so far. Windows much shorter than the
+    autocorrelation time make the drift test almost blind, so while the
+    blocking analysis has not converged the estimate is only a lower bound
+    and None is returned"""
+    if not all(blocking.is_converged() for blocking in blockings):
+        return None
+    tau_int = max(blocking.autocorrelation_time() for blocking in blockings)
+    return max(math.ceil(args.window_tau*tau_int/args.burn_window), 1)
+
+def tune_tau_window(polaron : Polaron, args : argparse.Namespace, tau_acceptance : float):
+    """Move the tau proposal window toward args.target_acceptance, shrinking
+    it when change_tau is rejected too often. The update weights are left
+    unchanged: equalizing the accepted add/remove and change_tau steps
+    starves add/remove at strong coupling and lengthens the autocorrelation"""
+    if math.isnan(tau_acceptance):
+        return
+    window = polaron.diagram['tau_window']*math.exp(tau_acceptance - args.target_acceptance)
+    polaron.diagram['tau_window'] = min(max(window, 1e-3*polaron.diagram['max_time']),
+                                        polaron.diagram['max_time'])
+
+def run_adaptive_thermalization(polaron : Polaron, args : argparse.Namespace,
+                                status : StatusWriter = None) -> Polaron :
+    """Thermalize in windows of args.burn_window steps, up to
+    args.nsteps_burn steps. After each window the tau proposal window is
+    tuned, and the thermalization stops as soon as order and energy pass
+    the drift test on windows of at least args.window_tau autocorrelation
+    times. The tuned window is then frozen, so the sampling steps satisfy
+    detailed balance. diagrams_info['Thermalization'] holds the outcome"""
+    order_means = []
+    energy_means = []
+    blockings = [BlockingAccumulator(), BlockingAccumulator()]
+    stationary = False
+    group = None
+    step = 1
+    while step < args.nsteps_burn and not stationary:
+        before = get_acceptances(polaron.diagrams_info['Updates'])
+        order_sum = 0.0
+        energy_sum = 0.0
+        window_steps = min(args.burn_window, args.nsteps_burn - step)
+        for _ in range(window_steps):
+            eval_update(polaron, is_timed(step, args))
+            polaron.eval_diagram_energy()
+            order_sum += polaron.diagram['order']
+            energy_sum += polaron.diagram['total_energy']
+            blockings[0].push(polaron.diagram['order'])
+            blockings[1].push(polaron.diagram['total_energy'])
+            if status is not None and step % status.every == 0:
+                status.write(polaron, 'thermalization', step, args.nsteps_burn)
+            step += 1
+        after = get_acceptances(polaron.diagrams_info['Updates'])
+        tune_tau_window(polaron, args, eval_window_acceptance(before, after, 'eval_change_tau'))
+        order_means.append(order_sum/window_steps)
+        energy_means.append(energy_sum/window_steps)
+        group = get_window_group(blockings, args)
+        stationary = group is not None and \
+            is_stationary(order_means, args.drift_windows, args.drift_threshold, group) and \
+            is_stationary(energy_means, args.drift_windows, args.drift_threshold, group)
+    polaron.diagrams_info['Thermalization'] = {'Steps': step - 1,
+                                               'Stationary': stationary,
+                                               'Window_steps': (group or 0)*args.burn_window,
+                                               'Tau_window': polaron.diagram['tau_window']}
+    return polaron
+
+def run_sampling_steps(polaron : Polaron, args : argparse.Namespace, first_step : int,
+                       last_step : int, checkpoint_file : str = None,
+                       status : StatusWriter = None):
+    """Perform the sampling steps from first_step to last_step excluded,
+    saving a checkpoint every args.checkpoint_every steps and reporting the
+    progress every status.every steps"""
+    total_steps = None if args.target_error is not None else args.nsteps
+    for step in range(first_step, last_step):
+        eval_update(polaron, is_timed(step, args))
+        polaron.eval_diagram_energy()
+        polaron.update_diagrams_info()
+        if checkpoint_file is not None and step % args.checkpoint_every == 0:
+            save_checkpoint(checkpoint_file, polaron, args, step + 1)
+        if status is not None and step % status.every == 0:
+            status.write(polaron, 'sampling', step, total_steps)
+
+def is_precise(blocking : dict, target_error : float) -> bool :
+    """True if the blocking errors of order and energy relative to their
+    means are both within target_error and have reached their plateau, an
+    error that is still growing with the block size underestimates the
+    true one. The target is relative because order and energy have
+    different scales"""
+    return all(blocking[name].is_converged() and
+               blocking[name].standard_error() <= target_error*abs(blocking[name].mean())
+               for name in ('Order', 'Energy'))
+
+def run_until_precise(polaron : Polaron, args : argparse.Namespace, first_step : int,
+                      checkpoint_file : str = None, status : StatusWriter = None) -> int :
+    """Sample in chunks of args.nsteps steps until the relative standard
+    errors of order and energy are converged and below args.target_error or
+    args.max_walltime seconds have passed. diagrams_info['Precision'] holds
+    the outcome.
+    Return the next step of the chain"""
+    start = time.perf_counter()
+    blocking = polaron.diagrams_info['Blocking']
+    step = first_step
+    precise = is_precise(blocking, args.target_error)
+    while not precise:
+        if time.perf_counter() - start > args.max_walltime:
+            break
+        run_sampling_steps(polaron, args, step, step + args.nsteps, checkpoint_file, status)
+        step += args.nsteps
+        precise = is_precise(blocking, args.target_error)
+    polaron.diagrams_info['Precision'] = {'Target_error': args.target_error,
+                                          'Steps': step - 1,
+                                          'Precise': precise,
+                                          'Wall_time': time.perf_counter() - start}
+    return step
+
+def run_diagrammatic_montecarlo(polaron : Polaron, args : argparse.Namespace,
+                                first_step : int = 1, checkpoint_file : str = None,
+                                status : StatusWriter = None) -> dict :
     """Input parameter:
     - args : list that contains the fundamental parameters for the simulation
+    - first_step : first sampling step to perform, larger than 1 when a
+      run is resumed from a checkpoint
+    - checkpoint_file : if given the state of the chain is saved there every
+      args.checkpoint_every steps and at the end of the run
+    - status : if given the progress is reported there every status.every
+      steps and when the run ends
+    With args.target_error the number of steps is not fixed, see
+    run_until_precise
     """
-    for _ in range(1, args.nsteps):
-        try:
-            if polaron.diagram['order'] == 0:
-                number = random.randrange(len(polaron.zero_order_updates))
-                polaron.zero_order_updates[number]()
-            else:
-                number = random.randrange(len(polaron.updates))
-                polaron.updates[number]()
-        except Exception as error:
-            print(f"Invalid step in DMC, {error}, {error.__class__}")
-            polaron.diagrams_info['Invalid_diagrams'] += 1
-            continue
-        polaron.eval_diagram_energy()
-        polaron.update_diagrams_info()
+    if args.target_error is not None:
+        last_step = run_until_precise(polaron, args, first_step, checkpoint_file, status)
+    else:
+        last_step = max(first_step, args.nsteps)
+        run_sampling_steps(polaron, args, first_step, last_step, checkpoint_file, status)
 
+    if checkpoint_file is not None:
+        save_checkpoint(checkpoint_file, polaron, args, last_step)
+    if status is not None:
+        status.write(polaron, 'finished', last_step - 1, last_step - 1)
     return polaron.diagrams_info
@@ -0,0 +1,252 @@
+"""Ensemble of independent Holstein polaron diagrams evolved together with
+NumPy. The phonon times of all the walkers are stored in padded 2-D arrays,
+one row per walker, next to a vector of orders. At each step every walker
+proposes one update and the proposals and Metropolis tests of add, remove
+and change_tau are evaluated as masked array operations, so the work of a
+step is spread over the vector units instead of the Python interpreter.
+"""
+
+import argparse
+import numpy as np
+from accumulators import BlockingAccumulator, GreenFunctionAccumulator, StreamingAccumulator
+
+INITIAL_CAPACITY = 64
+UPDATE_NAMES = ('eval_add_internal', 'eval_remove_internal', 'eval_change_tau')
+ADD = 0
+REMOVE = 1
+CHANGE_TAU = 2
+LOG_FLOAT_MAX = np.log(np.finfo(np.float64).max)
+"""Log of the probability of choosing remove from a first order diagram
+over the one of choosing add from a zero order diagram"""
+LOG_ZERO_ORDER_SELECTION = np.log(2/3)
+
+class WalkerBlocking:
+    """Blocking analysis of the series of every walker at once. The walkers
+    are independent chains pushed together, so the levels of
+    BlockingAccumulator are kept as arrays with one entry per walker and
+    a block is formed in all the walkers at the same step"""
+    def __init__(self, nwalkers : int):
+        self.nwalkers = nwalkers
+        self.counts = []
+        self.sums = []
+        self.sumsqs = []
+        self.pending = []
+
+    def push(self, values : np.ndarray):
+        """Fold one sample of each walker at level 0 and propagate the
+        completed blocks"""
+        level = 0
+        while True:
+            if level == len(self.counts):
+                self.counts.append(0)
+                self.sums.append(np.zeros(self.nwalkers))
+                self.sumsqs.append(np.zeros(self.nwalkers))
+                self.pending.append(None)
+            self.counts[level] += 1
+            self.sums[level] += values
+            self.sumsqs[level] += values*values
+            if self.pending[level] is None:
+                self.pending[level] = np.array(values, dtype=np.float64)
+                return
+            values = 0.5*(self.pending[level] + values)
+            self.pending[level] = None
+            level += 1
+
+    def to_accumulator(self) -> BlockingAccumulator :
+        """BlockingAccumulator equal to the merge of the analyses of the
+        single walkers, its samples are the steps of all the walkers"""
+        accumulator = BlockingAccumulator()
+        accumulator.counts = [count*self.nwalkers for count in self.counts]
+        accumulator.sums = [float(np.sum(sums)) for sums in self.sums]
+        accumulator.sumsqs = [float(np.sum(sumsqs)) for sumsqs in self.sumsqs]
+        accumulator.pending = [None]*len(self.counts)
+        return accumulator
+
+class EnsemblePolaron:
+    def __init__(self, args : argparse.Namespace, nwalkers : int,
+                 generator : np.random.Generator):
+        """nwalkers diagrams with the parameters in args, all the random
+        numbers are drawn from generator in arrays of one value per walker"""
+        self.generator = generator
+        self.nwalkers = nwalkers
+        self.phonon_energy = args.omega
+        self.electron_energy = args.mu
+        self.ep_coupling = args.g
+        self.max_time = float(args.max_time)
+        self.order = np.zeros(nwalkers, dtype=np.int64)
+        self.gen_times = np.zeros((nwalkers, INITIAL_CAPACITY), dtype=np.float64)
+        self.rem_times = np.zeros((nwalkers, INITIAL_CAPACITY), dtype=np.float64)
+        self.time_scaling = np.full(nwalkers, float(args.time_scaling))
+        self.phonons_time = np.zeros(nwalkers, dtype=np.float64)
+        self.total_energy = np.zeros(nwalkers, dtype=np.float64)
+        self.walkers = np.arange(nwalkers)
+        self.updates = {name: {'Proposed': 0, 'Accepted': 0, 'Rejected': 0, 'Extreme': 0,
+                               'Timed': 0, 'Time': 0.0}
+                        for name in UPDATE_NAMES}
+        for _ in range(args.order):
+            t_gen, t_rem = self.generate_phonons(self.walkers)
+            self.add_internal(self.walkers, t_gen, t_rem)
+
+    def grow(self):
+        """Double the number of phonon columns"""
+        padding = np.zeros_like(self.gen_times)
+        self.gen_times = np.concatenate((self.gen_times, padding), axis=1)
+        self.rem_times = np.concatenate((self.rem_times, padding), axis=1)
+
+    def log_metropolis(self, log_ratio : np.ndarray, update : int) -> np.ndarray :
+        """Metropolis test in log space of each walker as
+        Polaron.log_metropolis, extreme proposals are counted"""
+        extreme = ~(np.abs(log_ratio) < LOG_FLOAT_MAX)
+        self.updates[UPDATE_NAMES[update]]['Extreme'] += int(np.count_nonzero(extreme))
+        uniform = self.generator.random(len(log_ratio))
+        return (log_ratio >= 0) | (np.log1p(-uniform) < log_ratio)
+
+    def log_add_phonon_scaling(self, walkers : np.ndarray) -> np.ndarray :
+        return 2*np.log(np.abs(self.ep_coupling*self.time_scaling[walkers]))
+
+    def log_removal_time_prob(self, walkers : np.ndarray, t_gen : np.ndarray,
+                              t_rem : np.ndarray) -> np.ndarray :
+        """Log density of the removal times as Polaron.log_removal_time_prob,
+        uniform for the walkers with a zero alpha"""
+        alpha = self.phonon_energy*self.time_scaling[walkers]
+        uniform_limit = alpha == 0
+        alpha = np.where(uniform_limit, 1.0, alpha)
+        return np.where(uniform_limit, -np.log1p(-t_gen),
+                        np.log(alpha) - np.log(-np.expm1(-alpha*(1 - t_gen))) -
+                        alpha*(t_rem - t_gen))
+
+    def generate_phonons(self, walkers : np.ndarray) -> tuple :
+        """Scaled generation and removal times of a new phonon for each
+        walker, drawn as Polaron.generate_phonon does"""
+        t_gen = self.generator.random(len(walkers))
+        alpha = self.phonon_energy*self.time_scaling[walkers]
+        uniform_limit = alpha == 0
+        alpha = np.where(uniform_limit, 1.0, alpha)
+        uniform = self.generator.random(len(walkers))
+        span = -np.expm1(-alpha*(1 - t_gen))
+        t_rem = np.where(uniform_limit, t_gen + uniform*(1 - t_gen),
+                         t_gen - np.log1p(-uniform*span)/alpha)
+        return t_gen, np.minimum(t_rem, 1.0)
+
+    def add_internal(self, walkers : np.ndarray, t_gen : np.ndarray, t_rem : np.ndarray):
+        """Append a phonon to the diagram of each walker"""
+        if len(walkers) and self.order[walkers].max() == self.gen_times.shape[1]:
+            self.grow()
+        self.gen_times[walkers, self.order[walkers]] = t_gen
+        self.rem_times[walkers, self.order[walkers]] = t_rem
+        self.order[walkers] += 1
+        self.phonons_time[walkers] += t_rem - t_gen
+
+    def remove_internal(self, walkers : np.ndarray, tags : np.ndarray):
+        """Remove a phonon from the diagram of each walker, replacing it with
+        the last one of the row"""
+        last = self.order[walkers] - 1
+        self.phonons_time[walkers] -= self.rem_times[walkers, tags] - \
+            self.gen_times[walkers, tags]
+        self.gen_times[walkers, tags] = self.gen_times[walkers, last]
+        self.rem_times[walkers, tags] = self.rem_times[walkers, last]
+        self.order[walkers] = last
+        self.phonons_time[walkers[last == 0]] = 0.0
+
+    def count(self, update : int, proposed : int, accepted : int):
+        counters = self.updates[UPDATE_NAMES[update]]
+        counters['Proposed'] += proposed
+        counters['Accepted'] += accepted
+        counters['Rejected'] += proposed - accepted
+
+    def eval_add_internal(self, walkers : np.ndarray):
+        t_gen, t_rem = self.generate_phonons(walkers)
+        order = self.order[walkers]
+        log_ratio = self.log_add_phonon_scaling(walkers) - \
+            self.time_scaling[walkers]*self.phonon_energy*(t_rem - t_gen) - \
+            np.log(order + 1) - self.log_removal_time_prob(walkers, t_gen, t_rem) + \
+            np.where(order == 0, LOG_ZERO_ORDER_SELECTION, 0.0)
+        accepted = self.log_metropolis(log_ratio, ADD)
+        self.add_internal(walkers[accepted], t_gen[accepted], t_rem[accepted])
+        self.count(ADD, len(walkers), int(np.count_nonzero(accepted)))
+
+    def eval_remove_internal(self, walkers : np.ndarray):
+        order = self.order[walkers]
+        tags = np.minimum((self.generator.random(len(walkers))*order).astype(np.int64),
+                          order - 1)
+        t_gen = self.gen_times[walkers, tags]
+        t_rem = self.rem_times[walkers, tags]
+        log_ratio = self.time_scaling[walkers]*self.phonon_energy*(t_rem - t_gen) - \
+            self.log_add_phonon_scaling(walkers) + \
+            np.log(order) + self.log_removal_time_prob(walkers, t_gen, t_rem) - \
+            np.where(order == 1, LOG_ZERO_ORDER_SELECTION, 0.0)
+        accepted = self.log_metropolis(log_ratio, REMOVE)
+        self.remove_internal(walkers[accepted], tags[accepted])
+        self.count(REMOVE, len(walkers), int(np.count_nonzero(accepted)))
+
+    def eval_change_tau(self, walkers : np.ndarray):
+        new_tau = self.max_time*self.generator.random(len(walkers))
+        time_scaling = self.time_scaling[walkers]
+        log_ratio = -(new_tau - time_scaling) * \
+            (self.phonon_energy*self.phonons_time[walkers] + self.electron_energy) + \
+            2*self.order[walkers]*np.log(new_tau/time_scaling)
+        accepted = self.log_metropolis(log_ratio, CHANGE_TAU)
+        self.time_scaling[walkers[accepted]] = new_tau[accepted]
+        self.count(CHANGE_TAU, len(walkers), int(np.count_nonzero(accepted)))
+
+    def eval_update(self):
+        """Each walker performs one of the updates allowed for its diagram,
+        chosen with uniform probability as dmc.eval_update does"""
+        uniform = self.generator.random(self.nwalkers)
+        choice = np.where(self.order == 0, 2*(uniform*2).astype(np.int64),
+                          np.minimum((uniform*3).astype(np.int64), 2))
+        self.eval_add_internal(self.walkers[choice == ADD])
+        self.eval_remove_internal(self.walkers[choice == REMOVE])
+        self.eval_change_tau(self.walkers[choice == CHANGE_TAU])
+
+    def eval_diagram_energy(self):
+        """Energy of each walker as Polaron.eval_diagram_energy"""
+        energy = (self.phonon_energy*self.phonons_time - self.order)/self.time_scaling
+        self.total_energy = np.where(self.order == 0, 0.0, energy)
+
+def run_ensemble_montecarlo(args : argparse.Namespace,
+                            seed_sequence : np.random.SeedSequence) -> dict :
+    """Input parameter:
+    - args : list that contains the fundamental parameters for the simulation
+    Each of the args.nwalkers walkers performs args.nsteps_burn
+    thermalization steps and args.nsteps sampling steps, so nsteps,
+    nsteps_burn and green_batch count the steps of a single walker as they
+    do for the chain of the other engines. The blocking analysis merges the
+    ones of the single walkers and each batch of the Green's function
+    spans args.green_batch whole sweeps.
+    Return the same diagrams_info dictionary produced by
+    dmc.run_diagrammatic_montecarlo for a Polaron
+    """
+    ensemble = EnsemblePolaron(args, args.nwalkers, np.random.Generator(
+        np.random.PCG64(seed_sequence)))
+    for _ in range(1, args.nsteps_burn):
+        ensemble.eval_update()
+
+    blocking = {name: WalkerBlocking(args.nwalkers) for name in ('Order', 'Energy', 'Tau')}
+    green = GreenFunctionAccumulator(args.max_time, args.mu, args.tau_bins,
+                                     args.green_batch*args.nwalkers)
+    accumulator = StreamingAccumulator(args.max_time, args.tau_bins)
+    sequences = {'Order_sequence': [], 'Energy_sequence': []}
+    for sweep in range(max(args.nsteps, 1)):
+        if sweep > 0:
+            ensemble.eval_update()
+        ensemble.eval_diagram_energy()
+        blocking['Order'].push(ensemble.order.astype(np.float64))
+        blocking['Energy'].push(ensemble.total_energy)
+        blocking['Tau'].push(ensemble.time_scaling)
+        green.push_arrays(ensemble.order, ensemble.time_scaling)
+        if args.accumulate:
+            accumulator.push_arrays(ensemble.order, ensemble.total_energy,
+                                    ensemble.time_scaling)
+        else:
+            sequences['Order_sequence'].append(ensemble.order.copy())
+            sequences['Energy_sequence'].append(ensemble.total_energy)
+
+    diagrams_info = {'Blocking': {name: walker_blocking.to_accumulator()
+                                  for name, walker_blocking in blocking.items()},
+                     'Green': green, 'Updates': ensemble.updates}
+    if args.accumulate:
+        diagrams_info['Accumulator'] = accumulator
+    else:
+        diagrams_info.update({key: np.concatenate(values) for key, values in sequences.items()})
+    return diagrams_info
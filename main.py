@@ -2,23 +2,118 @@
    simulation such as the energy of both electron and phonon and the
    intensity of the electron phonon interaction. We can fix the "flight time"
    of the electron and the order of the initial diagram.
+
+   The work is split in three subcommands:
+   - run: perform the simulation and write the results to a .npz file, only
+     numpy and the engine are imported
+   - analyze: print the statistics of saved results
+   - plot: draw the figures of saved results with a headless backend
+   Without a subcommand the three steps are performed in a row and the
+   results are not saved. With --from-trace, analyze and plot rebuild the
+   histograms and the Green's function from the memory mapped traces of a
+   run made with --trace-dir.
+
+   Example:
+       python main.py run --g 1.0 --nsteps 1000000 --output g1.npz
+       python main.py analyze g1.npz
+       python main.py plot g1.npz --directory figures
 """
 
 import argparse
-import random
-import plot
+import sys
 from montecarlo_parser import MonteCarloParser
-from dmc import run_diagrammatic_montecarlo, run_thermalization_steps
-from polaron import Polaron
+from parallel import run_chain, run_parallel_chains, spawn_seeds
+from results import load_results, save_results
+
+COMMANDS = ('run', 'analyze', 'plot')
+
+def run(args : argparse.Namespace) -> dict :
+    """Run the chains and return the merged diagrams_info"""
+    if args.nchains > 1:
+        return run_parallel_chains(args)
+    return run_chain(args, spawn_seeds(args.seed, 1)[0])
 
+def analyze(diagrams_info : dict, fit_start : float = None):
+    """Print the statistics of a run"""
+    import plot
+    if 'Thermalization' in diagrams_info:
+        plot.print_thermalization(diagrams_info['Thermalization'])
+    if 'Precision' in diagrams_info:
+        plot.print_precision(diagrams_info['Precision'])
+    plot.print_update_statistics(diagrams_info['Updates'])
+    plot.print_error_analysis(diagrams_info['Blocking'])
+    plot.print_green_function_fit(diagrams_info['Green'], diagrams_info['Blocking']['Energy'],
+                                  fit_start)
+
+def use_trace(diagrams_info : dict, run_args : argparse.Namespace) -> dict :
+    """Replace the order and lifetime histograms and the Green's function of
+    a run with the ones rebuilt from its memory mapped traces, the blocking
+    analysis is kept"""
+    import plot
+    diagrams_info = {key: value for key, value in diagrams_info.items()
+                     if key not in ('Order_sequence', 'Energy_sequence')}
+    diagrams_info.update(plot.load_trace_info(diagrams_info['Trace'], run_args.max_time,
+                                              run_args.tau_bins, mu=run_args.mu,
+                                              green_batch=run_args.green_batch))
+    return diagrams_info
+
+def make_plots(diagrams_info : dict, fit_start : float = None, directory : str = '.',
+               show : bool = False, usetex : bool = False):
+    """Save the figures of a run in directory"""
+    import plot
+    plot.plot_montecarlo(diagrams_info, directory, show, usetex)
+    plot.plot_green_function(diagrams_info['Green'], fit_start, directory, show, usetex)
+
+def get_parser() -> argparse.ArgumentParser :
+    parser = argparse.ArgumentParser(description="Diagrammatic MonteCarlo of the Holstein "
+                                     "polaron")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', parents=[MonteCarloParser(add_help=False).parser],
+                                       help="Run the simulation and save the results")
+    run_parser.add_argument('--output', dest='output', type=str, default='dmc_results.npz',
+                        help="Path of the results file")
+    for command, description in (('analyze', "Print the statistics of saved results"),
+                                 ('plot', "Draw the figures of saved results")):
+        command_parser = subparsers.add_parser(command, help=description)
+        command_parser.add_argument('results', type=str, help="Path of the results file")
+        command_parser.add_argument('--green-fit-start', dest='green_fit_start', type=float,
+                        default=None, help="Lower bound of the lifetimes used in the fit "
+                        "of the Green's function tail, the value of the run by default")
+        command_parser.add_argument('--from-trace', dest='from_trace', action='store_true',
+                        help="Rebuild the histograms and the Green's function from the "
+                        "traces written with --trace-dir")
+    plot_parser = subparsers.choices['plot']
+    plot_parser.add_argument('--directory', dest='directory', type=str, default='.',
+                        help="Directory where the figures are saved")
+    plot_parser.add_argument('--show', dest='show', action='store_true',
+                        help="Show the figures in a window")
+    plot_parser.add_argument('--usetex', dest='usetex', action='store_true',
+                        help="Render the text of the figures with LaTeX")
+    return parser
 
 if __name__ == "__main__":
 
-    mc_parser=MonteCarloParser()
-    args=mc_parser.parser.parse_args()
-    polaron = Polaron(args)
-    polaron = run_thermalization_steps(polaron, args)
-    polaron.update_diagrams_info()
-    diagrams_info = run_diagrammatic_montecarlo(polaron, args)
-    plot.plot_montecarlo(diagrams_info)
-    plot.plot_green_function(diagrams_info['Tau_sequence'])
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS + ('-h', '--help'):
+        args = MonteCarloParser().parser.parse_args()
+        diagrams_info = run(args)
+        analyze(diagrams_info, args.green_fit_start)
+        make_plots(diagrams_info, args.green_fit_start)
+        sys.exit(0)
+
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.command == 'run':
+        save_results(args.output, run(args), args)
+    else:
+        diagrams_info, run_args = load_results(args.results)
+        if args.from_trace:
+            if 'Trace' not in diagrams_info:
+                parser.error(f"{args.results} was run without --trace-dir")
+            diagrams_info = use_trace(diagrams_info, run_args)
+        fit_start = args.green_fit_start
+        if fit_start is None:
+            fit_start = run_args.green_fit_start
+        if args.command == 'analyze':
+            analyze(diagrams_info, fit_start)
+        else:
+            make_plots(diagrams_info, fit_start, args.directory, args.show, args.usetex)
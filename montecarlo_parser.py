@@ -3,18 +3,56 @@ of a MonteCarloParser object"""
 
 import argparse
 
+def positive_int(value : str) -> int :
+    """argparse type for the options that are used as a step period"""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
 class MonteCarloParser:
-    def __init__(self):
+    def __init__(self, add_help : bool = True):
+        """Without add_help the parser can be the parent of a subcommand"""
         self.parser = argparse.ArgumentParser(prog="""Markov Chain MonteCarlo to
             reconstruct a distribution through an histogram""",
             description="""In this program we reconstruct an exponential
             probability distribution sampling the occurrences extracted
             from the target. We employ a Metropolis algorithm to sample
-            different values from the distribution.""")
+            different values from the distribution.""", add_help=add_help)
         self.parser.add_argument('--nsteps', dest='nsteps', type=int, default=10000,
                         help="Number of MonteCarlo steps (samples)")
+        self.parser.add_argument('--target-error', dest='target_error', type=float,
+                        default=None, help="""Sample in chunks of nsteps steps until the
+                        standard errors of mean order and energy relative to the means
+                        are below this value""")
+        self.parser.add_argument('--max-walltime', dest='max_walltime', type=float,
+                        default=3600.0, help="Seconds after which a run with --target-error "
+                        "stops even if the errors are larger than the target")
         self.parser.add_argument('--nsteps_burn', dest='nsteps_burn', type=int, default=10000,
                         help="Number of thermalization steps for the Markov Chain")
+        self.parser.add_argument('--adaptive-burn', dest='adaptive_burn', action='store_true',
+                        help="""Stop the thermalization once order and energy are stationary,
+                        tuning the tau proposal window,
+                        nsteps_burn is then the largest number of steps""")
+        self.parser.add_argument('--burn-window', dest='burn_window', type=int, default=1000,
+                        help="""Steps between two tunings of the adaptive thermalization, the
+                        windows of the drift test are made of a whole number of them""")
+        self.parser.add_argument('--window-tau', dest='window_tau', type=float, default=20.0,
+                        help="""Smallest length of the windows of the drift test in units of
+                        the autocorrelation time estimated during the thermalization""")
+        self.parser.add_argument('--drift-windows', dest='drift_windows', type=int, default=5,
+                        help="Windows compared by the drift test on each side")
+        self.parser.add_argument('--drift-threshold', dest='drift_threshold', type=float,
+                        default=2.0, help="Largest drift in standard errors of a stationary series")
+        self.parser.add_argument('--target-acceptance', dest='target_acceptance', type=float,
+                        default=0.25, help="Acceptance rate of change_tau targeted by the "
+                        "adaptive thermalization")
+        self.parser.add_argument('--shift-weight', dest='shift_weight', type=float,
+                        default=0.0, help="Probability of the local update that shifts a "
+                        "vertex between its neighbours, relative to add, remove and change_tau. "
+                        "In the atomic limit the weight depends on the vertices only through "
+                        "the total phonon time, so the shift does not lower tau_int and is off "
+                        "by default")
         self.parser.add_argument('--order', dest='order', type=int, default=0,
                         help="Order of the initial diagram")
         self.parser.add_argument('--mu', dest='mu', type=float, default=0.0,
@@ -27,3 +65,56 @@ class MonteCarloParser:
                         help="Initial lifetime of electron propagator")
         self.parser.add_argument('--max_time', dest='max_time', type=int, default=50,
                         help="Upper bound for lifetime of electron propagator")
+        self.parser.add_argument('--engine', dest='engine', type=str, default='python',
+                        choices=['python', 'numba', 'ensemble'],
+                        help="Engine that runs the Markov chain")
+        self.parser.add_argument('--nwalkers', dest='nwalkers', type=int, default=1024,
+                        help="""Number of diagrams evolved together by the ensemble engine, each
+                        one performs nsteps_burn and nsteps steps""")
+        self.parser.add_argument('--nchains', dest='nchains', type=int, default=1,
+                        help="Number of independent Markov chains")
+        self.parser.add_argument('--nworkers', dest='nworkers', type=int, default=None,
+                        help="Number of worker processes for the chains")
+        self.parser.add_argument('--seed', dest='seed', type=int, default=None,
+                        help="""Master seed from which the chains random streams are spawned,
+                        the same seed reproduces the same run""")
+        self.parser.add_argument('--accumulate', dest='accumulate', action='store_true',
+                        help="Store running statistics instead of the full sequences")
+        self.parser.add_argument('--tau-bins', dest='tau_bins', type=int, default=50,
+                        help="Number of bins of the lifetime histogram")
+        self.parser.add_argument('--green-batch', dest='green_batch', type=int, default=1000,
+                        help="Samples in each batch of the Green's function error bars")
+        self.parser.add_argument('--green-fit-start', dest='green_fit_start', type=float,
+                        default=None, help="Lower bound of the lifetimes used in the fit "
+                        "of the Green's function tail, half of max_time by default")
+        self.parser.add_argument('--checkpoint-every', dest='checkpoint_every', type=int,
+                        default=0, help="Save a checkpoint every N sampling steps")
+        self.parser.add_argument('--checkpoint-file', dest='checkpoint_file', type=str,
+                        default='dmc_checkpoint.npz', help="Path of the checkpoint file")
+        self.parser.add_argument('--resume', dest='resume', type=str, default=None,
+                        help="Resume the Markov chain from a checkpoint file")
+        self.parser.add_argument('--cache-dir', dest='cache_dir', type=str, default=None,
+                        help="""Directory of the cache of finished chains, a chain with the
+                        same parameters and seed is reused and extended if needed""")
+        self.parser.add_argument('--cache-size', dest='cache_size', type=float, default=1024,
+                        help="Largest size of the cache in megabytes")
+        self.parser.add_argument('--trace-dir', dest='trace_dir', type=str, default=None,
+                        help="Directory where the per-step traces are streamed")
+        self.parser.add_argument('--trace-chunk', dest='trace_chunk', type=int,
+                        default=65536, help="Number of steps buffered before writing traces")
+        self.parser.add_argument('--status-file', dest='status_file', type=str, default=None,
+                        help="""JSON file rewritten during the run with the progress and the
+                        running estimates of the chain""")
+        self.parser.add_argument('--status-every', dest='status_every', type=positive_int,
+                        default=100000, help="Steps between two rewrites of the status file")
+        self.parser.add_argument('--timing-every', dest='timing_every', type=int, default=0,
+                        help="Time one update every N steps, 0 disables the timers")
+
+    def reject_options(self, args : argparse.Namespace, destinations : tuple, reason : str):
+        """Exit with an error if one of the options stored in destinations
+        was changed from its default, for the programs that reuse the
+        parser but do not support every option"""
+        for action in self.parser._actions:
+            if action.dest in destinations and \
+                    getattr(args, action.dest) != action.default:
+                self.parser.error(f"{action.option_strings[0]} {reason}")
@@ -0,0 +1,444 @@
+"""Array backed Holstein polaron compiled with numba. The diagram is stored
+in preallocated float64 arrays for the generation and removal times of the
+phonons, together with an order counter, so that the whole Markov chain can
+run inside a single @njit function without touching the Python interpreter.
+"""
+
+import argparse
+import numpy as np
+from accumulators import BlockingAccumulator, GreenFunctionAccumulator, StreamingAccumulator
+from numba import njit, types
+from numba.experimental import jitclass
+from numba.typed import List
+
+INITIAL_CAPACITY = 64
+MAX_LEVELS = 64
+UPDATE_NAMES = ('eval_add_internal', 'eval_remove_internal', 'eval_change_tau')
+REJECTED = 0
+ACCEPTED = 1
+EXTREME = 2
+LOG_FLOAT_MAX = np.log(np.finfo(np.float64).max)
+"""Log of the probability of choosing remove from a first order diagram
+over the one of choosing add from a zero order diagram"""
+LOG_ZERO_ORDER_SELECTION = np.log(2/3)
+
+spec = [('order', types.int64),
+        ('gen_times', types.float64[:]),
+        ('rem_times', types.float64[:]),
+        ('phonon_energy', types.float64),
+        ('electron_energy', types.float64),
+        ('ep_coupling', types.float64),
+        ('time_scaling', types.float64),
+        ('max_time', types.float64),
+        ('phonons_time', types.float64),
+        ('total_energy', types.float64),
+        ('energy_outdated', types.boolean),
+        ('counters', types.int64[:, :])]
+
+@jitclass(spec)
+class NumbaPolaron:
+
+    def __init__(self, order, phonon_energy, electron_energy, ep_coupling,
+                 time_scaling, max_time):
+        self.order = 0
+        self.gen_times = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.rem_times = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self.phonon_energy = phonon_energy
+        self.electron_energy = electron_energy
+        self.ep_coupling = ep_coupling
+        self.time_scaling = time_scaling
+        self.max_time = max_time
+        self.phonons_time = 0.0
+        self.total_energy = 0.0
+        self.energy_outdated = False
+        self.counters = np.zeros((3, 3), dtype=np.int64)
+        for _ in range(order):
+            t_gen, t_rem = self.generate_phonon()
+            self.add_internal(t_gen, t_rem)
+
+    def grow(self):
+        """Double the capacity of the phonon arrays"""
+        capacity = 2*self.gen_times.shape[0]
+        gen_times = np.empty(capacity, dtype=np.float64)
+        rem_times = np.empty(capacity, dtype=np.float64)
+        gen_times[:self.order] = self.gen_times[:self.order]
+        rem_times[:self.order] = self.rem_times[:self.order]
+        self.gen_times = gen_times
+        self.rem_times = rem_times
+
+    def log_metropolis(self, log_ratio, number):
+        """Metropolis test in log space as Polaron.log_metropolis, extreme
+        proposals are counted in the row of the update"""
+        if not -LOG_FLOAT_MAX < log_ratio < LOG_FLOAT_MAX:
+            self.counters[number, EXTREME] += 1
+        if log_ratio >= 0:
+            return True
+        return np.log1p(-np.random.uniform(0, 1)) < log_ratio
+
+    def log_add_phonon_scaling(self):
+        return 2*np.log(abs(self.ep_coupling*self.time_scaling))
+
+    def log_removal_time_prob(self, t_gen, t_rem):
+        alpha = self.phonon_energy*self.time_scaling
+        if alpha == 0:
+            return -np.log1p(-t_gen)
+        return np.log(alpha) - np.log(-np.expm1(-alpha*(1 - t_gen))) - alpha*(t_rem - t_gen)
+
+    def generate_phonon(self):
+        """Removal time from the truncated exponential, as Polaron.generate_phonon"""
+        t_gen = np.random.uniform(0, 1)
+        alpha = self.phonon_energy*self.time_scaling
+        if alpha == 0:
+            return t_gen, t_gen + np.random.uniform(0, 1)*(1 - t_gen)
+        span = -np.expm1(-alpha*(1 - t_gen))
+        t_rem = t_gen - np.log1p(-np.random.uniform(0, 1)*span)/alpha
+        return t_gen, min(t_rem, 1.0)
+
+    def add_internal(self, t_gen, t_rem):
+        if self.order == self.gen_times.shape[0]:
+            self.grow()
+        self.gen_times[self.order] = t_gen
+        self.rem_times[self.order] = t_rem
+        self.order += 1
+        self.phonons_time += t_rem - t_gen
+        self.energy_outdated = True
+
+    def remove_internal(self, phonon_tag):
+        """Overwrite the removed phonon with the last one"""
+        last = self.order - 1
+        if last == 0:
+            self.phonons_time = 0.0
+        else:
+            self.phonons_time -= self.rem_times[phonon_tag] - self.gen_times[phonon_tag]
+        self.energy_outdated = True
+        self.gen_times[phonon_tag] = self.gen_times[last]
+        self.rem_times[phonon_tag] = self.rem_times[last]
+        self.order = last
+
+    def eval_add_internal(self):
+        t_gen, t_rem = self.generate_phonon()
+        log_ratio = self.log_add_phonon_scaling() - \
+            self.time_scaling*self.phonon_energy*(t_rem - t_gen) - \
+            np.log(self.order + 1) - self.log_removal_time_prob(t_gen, t_rem)
+        if self.order == 0:
+            log_ratio += LOG_ZERO_ORDER_SELECTION
+        if self.log_metropolis(log_ratio, 0):
+            self.add_internal(t_gen, t_rem)
+            return ACCEPTED
+        return REJECTED
+
+    def eval_remove_internal(self):
+        phonon_tag = np.random.randint(0, self.order)
+        t_gen = self.gen_times[phonon_tag]
+        t_rem = self.rem_times[phonon_tag]
+        log_ratio = self.time_scaling*self.phonon_energy*(t_rem - t_gen) - \
+            self.log_add_phonon_scaling() + \
+            np.log(self.order) + self.log_removal_time_prob(t_gen, t_rem)
+        if self.order == 1:
+            log_ratio -= LOG_ZERO_ORDER_SELECTION
+        if self.log_metropolis(log_ratio, 1):
+            self.remove_internal(phonon_tag)
+            return ACCEPTED
+        return REJECTED
+
+    def eval_change_tau(self):
+        new_tau = np.random.uniform(0, self.max_time)
+        while new_tau == self.time_scaling:
+            new_tau = np.random.uniform(0, self.max_time)
+        log_ratio = -(new_tau - self.time_scaling) * \
+            (self.phonon_energy*self.phonons_time + self.electron_energy) + \
+            2*self.order*np.log(new_tau/self.time_scaling)
+        if self.log_metropolis(log_ratio, 2):
+            self.time_scaling = new_tau
+            self.energy_outdated = True
+            return ACCEPTED
+        return REJECTED
+
+    def eval_update(self):
+        """Pick one of the updates allowed for the current order with
+        uniform probability and perform it. The outcome is counted in the
+        row of the update"""
+        if self.order == 0:
+            number = 2*np.random.randint(0, 2)
+        else:
+            number = np.random.randint(0, 3)
+        if number == 0:
+            status = self.eval_add_internal()
+        elif number == 1:
+            status = self.eval_remove_internal()
+        else:
+            status = self.eval_change_tau()
+        self.counters[number, status] += 1
+
+    def eval_diagram_energy(self):
+        if not self.energy_outdated:
+            return
+        if self.order == 0:
+            self.total_energy = 0.0
+        else:
+            self.total_energy = (self.phonon_energy*self.phonons_time -
+                                 self.order)/self.time_scaling
+        self.energy_outdated = False
+
+
+@njit
+def seed_numba_random(seed):
+    """Seed the random state used inside compiled functions, which is
+    separate from the one of numpy"""
+    np.random.seed(seed)
+
+@njit
+def thermalize(polaron, nsteps_burn):
+    """Thermalization steps"""
+    for _ in range(1, nsteps_burn):
+        polaron.eval_update()
+
+@njit
+def push_blocks(blocks, polaron):
+    """Blocking analysis of order, energy and tau as BlockingAccumulator
+    does. blocks[row] holds count, sum, sum of squares, pending value and
+    pending flag of each level"""
+    values = (float(polaron.order), polaron.total_energy, polaron.time_scaling)
+    for row in range(3):
+        value = values[row]
+        for level in range(MAX_LEVELS):
+            blocks[row, 0, level] += 1
+            blocks[row, 1, level] += value
+            blocks[row, 2, level] += value*value
+            if blocks[row, 4, level] == 0:
+                blocks[row, 3, level] = value
+                blocks[row, 4, level] = 1
+                break
+            value = 0.5*(blocks[row, 3, level] + value)
+            blocks[row, 4, level] = 0
+
+@njit
+def push_green(green, green_counts, polaron, batch_size):
+    """Green's function estimator as GreenFunctionAccumulator does. green
+    holds by row the histogram, the sums and sums of squares of the
+    completed batches and the current batch, green_counts the samples in the
+    current batch, the completed batches and the zero order samples"""
+    tau_bins = green.shape[1]
+    tau_bin = min(int(polaron.time_scaling/(polaron.max_time/tau_bins)), tau_bins - 1)
+    green[3, tau_bin] += 1
+    if polaron.order == 0:
+        green_counts[2] += 1
+    green_counts[0] += 1
+    if green_counts[0] == batch_size:
+        for column in range(tau_bins):
+            green[0, column] += green[3, column]
+            green[1, column] += green[3, column]
+            green[2, column] += green[3, column]*green[3, column]
+            green[3, column] = 0
+        green_counts[0] = 0
+        green_counts[1] += 1
+
+def green_from_array(green, green_counts, args : argparse.Namespace) -> GreenFunctionAccumulator :
+    """Convert the arrays filled by push_green in a GreenFunctionAccumulator"""
+    accumulator = GreenFunctionAccumulator(args.max_time, args.mu, args.tau_bins,
+                                           args.green_batch)
+    accumulator.histogram = green[0].astype(np.int64)
+    accumulator.sums = green[1].copy()
+    accumulator.sumsqs = green[2].copy()
+    accumulator.batch = green[3].astype(np.int64).tolist()
+    accumulator.batch_count = int(green_counts[0])
+    accumulator.batches = int(green_counts[1])
+    accumulator.zero_order = int(green_counts[2])
+    return accumulator
+
+def blocking_from_array(blocks) -> dict :
+    """Convert the blocks filled by push_blocks in BlockingAccumulators"""
+    blocking = {}
+    for name, levels in zip(('Order', 'Energy', 'Tau'), blocks):
+        accumulator = BlockingAccumulator()
+        nlevels = np.count_nonzero(levels[0])
+        accumulator.counts = [int(count) for count in levels[0, :nlevels]]
+        accumulator.sums = [float(total) for total in levels[1, :nlevels]]
+        accumulator.sumsqs = [float(sumsq) for sumsq in levels[2, :nlevels]]
+        accumulator.pending = [float(value) if flag else None
+                               for value, flag in zip(levels[3, :nlevels],
+                                                      levels[4, :nlevels])]
+        blocking[name] = accumulator
+    return blocking
+
+@njit
+def montecarlo(polaron, nsteps_burn, nsteps, tau_bins, batch_size):
+    """Run thermalization and sampling of the Markov chain. The arrays
+    hold one entry for the thermalized diagram plus one for each sampling
+    step, the thermalized diagram is sampled even when nsteps is 0 as the
+    Polaron engine does."""
+    thermalize(polaron, nsteps_burn)
+    blocks = np.zeros((3, 5, MAX_LEVELS), dtype=np.float64)
+    push_blocks(blocks, polaron)
+    green = np.zeros((4, tau_bins), dtype=np.float64)
+    green_counts = np.zeros(3, dtype=np.int64)
+    push_green(green, green_counts, polaron, batch_size)
+
+    order_sequence = np.empty(max(nsteps, 1), dtype=np.int64)
+    energy_sequence = np.empty(max(nsteps, 1), dtype=np.float64)
+    order_sequence[0] = polaron.order
+    energy_sequence[0] = polaron.total_energy
+    for step in range(1, nsteps):
+        polaron.eval_update()
+        polaron.eval_diagram_energy()
+        order_sequence[step] = polaron.order
+        energy_sequence[step] = polaron.total_energy
+        push_blocks(blocks, polaron)
+        push_green(green, green_counts, polaron, batch_size)
+
+    return order_sequence, energy_sequence, blocks, green, green_counts
+
+@njit
+def montecarlo_accumulate(polaron, nsteps_burn, nsteps, tau_bins, batch_size):
+    """Run thermalization and sampling of the Markov chain folding the
+    samples in running moments and histograms as StreamingAccumulator does.
+    moments holds count, mean and m2 of order, energy and tau by row."""
+    thermalize(polaron, nsteps_burn)
+    blocks = np.zeros((3, 5, MAX_LEVELS), dtype=np.float64)
+    moments = np.zeros((3, 3), dtype=np.float64)
+    order_histogram = np.zeros(64, dtype=np.int64)
+    tau_histogram = np.zeros(tau_bins, dtype=np.int64)
+    tau_bin_width = polaron.max_time/tau_bins
+    green = np.zeros((4, tau_bins), dtype=np.float64)
+    green_counts = np.zeros(3, dtype=np.int64)
+    values = np.empty(3, dtype=np.float64)
+    for step in range(max(nsteps, 1)):
+        if step > 0:
+            polaron.eval_update()
+            polaron.eval_diagram_energy()
+        values[0] = polaron.order
+        values[1] = polaron.total_energy
+        values[2] = polaron.time_scaling
+        for row in range(3):
+            moments[row, 0] += 1
+            delta = values[row] - moments[row, 1]
+            moments[row, 1] += delta/moments[row, 0]
+            moments[row, 2] += delta*(values[row] - moments[row, 1])
+        if polaron.order >= order_histogram.shape[0]:
+            grown = np.zeros(2*polaron.order, dtype=np.int64)
+            grown[:order_histogram.shape[0]] = order_histogram
+            order_histogram = grown
+        order_histogram[polaron.order] += 1
+        tau_histogram[min(int(polaron.time_scaling/tau_bin_width), tau_bins - 1)] += 1
+        push_blocks(blocks, polaron)
+        push_green(green, green_counts, polaron, batch_size)
+
+    return moments, order_histogram, tau_histogram, blocks, green, green_counts
+
+@njit
+def swap_diagrams(first, second):
+    """Exchange the diagrams of two chains of a ladder as
+    tempering.swap_diagrams, the couplings stay with their chains"""
+    first.order, second.order = second.order, first.order
+    first.gen_times, second.gen_times = second.gen_times, first.gen_times
+    first.rem_times, second.rem_times = second.rem_times, first.rem_times
+    first.time_scaling, second.time_scaling = second.time_scaling, first.time_scaling
+    first.phonons_time, second.phonons_time = second.phonons_time, first.phonons_time
+    first.total_energy, second.total_energy = second.total_energy, first.total_energy
+    first.energy_outdated, second.energy_outdated = second.energy_outdated, \
+        first.energy_outdated
+
+@njit
+def propose_swaps(replicas, swaps, parity):
+    """Propose the exchange of the neighbouring chains (k, k+1) with k of
+    the given parity as tempering.propose_swaps"""
+    for pair in range(parity, len(replicas) - 1, 2):
+        first = replicas[pair]
+        second = replicas[pair + 1]
+        swaps[0, pair] += 1
+        order_change = second.order - first.order
+        log_ratio = 0.0
+        if order_change != 0:
+            log_ratio = 2*order_change*(np.log(abs(first.ep_coupling)) -
+                                        np.log(abs(second.ep_coupling)))
+        if log_ratio >= 0 or np.log1p(-np.random.uniform(0, 1)) < log_ratio:
+            swap_diagrams(first, second)
+            swaps[1, pair] += 1
+
+@njit
+def montecarlo_ladder(replicas, nsteps_burn, nsteps, swap_every, tau_bins, batch_size):
+    """Run thermalization and sampling of all the chains of a tempering
+    ladder in one compiled loop, proposing swaps every swap_every steps.
+    blocks, green and green_counts hold the arrays of push_blocks and
+    push_green of each chain along the first axis"""
+    nreplicas = len(replicas)
+    swaps = np.zeros((2, nreplicas - 1), dtype=np.int64)
+    for step in range(1, nsteps_burn):
+        for replica in replicas:
+            replica.eval_update()
+        if swap_every > 0 and step % swap_every == 0:
+            propose_swaps(replicas, swaps, (step//swap_every) % 2)
+    swaps[:] = 0
+
+    blocks = np.zeros((nreplicas, 3, 5, MAX_LEVELS), dtype=np.float64)
+    green = np.zeros((nreplicas, 4, tau_bins), dtype=np.float64)
+    green_counts = np.zeros((nreplicas, 3), dtype=np.int64)
+    for step in range(max(nsteps, 1)):
+        for index in range(nreplicas):
+            replica = replicas[index]
+            if step > 0:
+                replica.eval_update()
+            replica.eval_diagram_energy()
+            push_blocks(blocks[index], replica)
+            push_green(green[index], green_counts[index], replica, batch_size)
+        if step > 0 and swap_every > 0 and step % swap_every == 0:
+            propose_swaps(replicas, swaps, (step//swap_every) % 2)
+    return blocks, green, green_counts, swaps
+
+def updates_from_counters(counters) -> dict :
+    """Update counters in the format of Polaron diagrams_info['Updates'],
+    the compiled engine has no timers"""
+    return {name: {'Proposed': int(row[:EXTREME].sum()), 'Accepted': int(row[ACCEPTED]),
+                   'Rejected': int(row[REJECTED]), 'Extreme': int(row[EXTREME]),
+                   'Timed': 0, 'Time': 0.0}
+            for name, row in zip(UPDATE_NAMES, counters)}
+
+def run_numba_montecarlo(args : argparse.Namespace) -> dict :
+    """Input parameter:
+    - args : list that contains the fundamental parameters for the simulation
+    Return the same diagrams_info dictionary produced by
+    dmc.run_diagrammatic_montecarlo for a Polaron
+    """
+    polaron = NumbaPolaron(args.order, args.omega, args.mu, args.g,
+                           args.time_scaling, args.max_time)
+    if args.accumulate:
+        moments, order_histogram, tau_histogram, blocks, green, green_counts = \
+            montecarlo_accumulate(polaron, args.nsteps_burn, args.nsteps, args.tau_bins,
+                                  args.green_batch)
+        accumulator = StreamingAccumulator(args.max_time, args.tau_bins)
+        for running_moments, row in zip((accumulator.order, accumulator.energy,
+                                         accumulator.tau), moments):
+            running_moments.count = int(row[0])
+            running_moments.mean, running_moments.m2 = float(row[1]), float(row[2])
+        accumulator.order_histogram = order_histogram
+        accumulator.tau_histogram = tau_histogram
+        return {'Accumulator': accumulator,
+                'Blocking': blocking_from_array(blocks),
+                'Green': green_from_array(green, green_counts, args),
+                'Updates': updates_from_counters(polaron.counters)}
+    order_sequence, energy_sequence, blocks, green, green_counts = \
+        montecarlo(polaron, args.nsteps_burn, args.nsteps, args.tau_bins, args.green_batch)
+    return {'Order_sequence' : order_sequence,
+            'Energy_sequence': energy_sequence,
+            'Blocking': blocking_from_array(blocks),
+            'Green': green_from_array(green, green_counts, args),
+            'Updates': updates_from_counters(polaron.counters)}
+
+def run_numba_tempering(args : argparse.Namespace, couplings : np.ndarray) -> tuple :
+    """Input parameter:
+    - args : list that contains the fundamental parameters for the simulation
+    - couplings : the coupling of each chain of the ladder
+    Return the diagrams_info of each chain, with the same keys used by
+    tempering.run_tempering, and the swap counters"""
+    replicas = List()
+    for g in couplings:
+        replicas.append(NumbaPolaron(args.order, args.omega, args.mu, float(g),
+                                     args.time_scaling, args.max_time))
+    blocks, green, green_counts, swaps = montecarlo_ladder(
+        replicas, args.nsteps_burn, args.nsteps, args.swap_every, args.tau_bins,
+        args.green_batch)
+    chains_info = [{'Blocking': blocking_from_array(blocks[index]),
+                    'Green': green_from_array(green[index], green_counts[index], args),
+                    'Updates': updates_from_counters(replica.counters)}
+                   for index, replica in enumerate(replicas)]
+    return chains_info, swaps
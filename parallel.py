@@ -0,0 +1,191 @@
+"""Helper functions that run several independent Markov chains for the same
+Holstein polaron parameters across a pool of processes. Every chain performs
+its own thermalization and draws from its own random stream, spawned from a
+single master seed so that a run can be reproduced."""
+
+import argparse
+import copy
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from polaron import Polaron
+from random_source import RandomSource
+from checkpoint import PARAMETERS, checkpoint_path, load_checkpoint, save_checkpoint
+from trace_writer import TraceWriter
+from status import StatusWriter
+from dmc import run_diagrammatic_montecarlo, run_thermalization_steps
+
+def spawn_seeds(seed, nchains : int) -> list :
+    """Return one independent SeedSequence for each chain, all spawned from
+    the master seed. If seed is None fresh entropy is drawn from the OS."""
+    return np.random.SeedSequence(seed).spawn(nchains)
+
+def run_chain(args : argparse.Namespace, seed_sequence : np.random.SeedSequence,
+              chain : int = 0) -> dict :
+    """Run thermalization and sampling of a single Markov chain.
+    The random numbers used by the engine are drawn from a stream seeded
+    with seed_sequence so that each worker process is independent.
+    If args.resume is given the chain restarts from its checkpoint and the
+    thermalization is skipped. If args.trace_dir is given the traces are
+    streamed to disk and diagrams_info['Trace'] holds their directory.
+    If args.cache_dir is given the chain goes through the cache of cache.py.
+    If args.status_file is given the progress of the chain is written there"""
+    if args.engine != 'python':
+        if args.checkpoint_every > 0 or args.resume is not None:
+            raise ValueError("Checkpoints are supported only by the python engine")
+        if args.trace_dir is not None:
+            raise ValueError("Traces are supported only by the python engine")
+        if args.adaptive_burn:
+            raise ValueError("Adaptive thermalization is supported only by the python engine")
+        if args.cache_dir is not None:
+            raise ValueError("The cache is supported only by the python engine")
+        if args.target_error is not None:
+            raise ValueError("Runs with a target error are supported only by the python engine")
+        if args.status_file is not None:
+            raise ValueError("Status files are supported only by the python engine")
+        if args.shift_weight > 0:
+            raise ValueError("The shift update is supported only by the python engine")
+        if args.timing_every > 0:
+            raise ValueError("Update timers are supported only by the python engine")
+    if args.engine == 'ensemble':
+        from ensemble_polaron import run_ensemble_montecarlo
+        return run_ensemble_montecarlo(args, seed_sequence)
+    if args.engine == 'numba':
+        from numba_polaron import run_numba_montecarlo, seed_numba_random
+        seed_numba_random(int(seed_sequence.generate_state(1)[0]))
+        return run_numba_montecarlo(args)
+
+    status = None
+    if args.status_file is not None:
+        status = StatusWriter(checkpoint_path(args.status_file, chain, args.nchains),
+                              args.status_every, chain)
+    if args.cache_dir is not None:
+        if args.seed is None:
+            raise ValueError("Cached chains need a --seed")
+        if args.checkpoint_every > 0 or args.resume is not None or args.trace_dir is not None:
+            raise ValueError("Cached chains do not support checkpoints and traces")
+        if args.target_error is not None:
+            raise ValueError("Cached chains need a fixed number of steps")
+        from cache import run_cached_chain
+        return run_cached_chain(args, seed_sequence, chain, status)
+
+    checkpoint_file = None
+    if args.checkpoint_every > 0:
+        checkpoint_file = checkpoint_path(args.checkpoint_file, chain, args.nchains)
+    if args.resume is not None:
+        polaron, first_step = load_checkpoint(checkpoint_path(args.resume, chain,
+                                                              args.nchains), args)
+        samples = polaron.diagrams_info['Blocking']['Order'].counts[0]
+    else:
+        polaron = Polaron(args, RandomSource(seed_sequence))
+        polaron = run_thermalization_steps(polaron, args, status)
+        first_step = 1
+        samples = 0
+    if args.trace_dir is not None:
+        trace_dir = args.trace_dir
+        if args.nchains > 1:
+            trace_dir = os.path.join(trace_dir, f"chain{chain}")
+        parameters = {name: getattr(args, name) for name in PARAMETERS}
+        polaron.diagrams_info['Trace'] = TraceWriter(trace_dir, args.trace_chunk, samples,
+                                                     parameters)
+    if args.resume is None:
+        polaron.update_diagrams_info()
+        if checkpoint_file is not None:
+            save_checkpoint(checkpoint_file, polaron, args, first_step)
+    diagrams_info = run_diagrammatic_montecarlo(polaron, args, first_step, checkpoint_file,
+                                                status)
+    if 'Trace' in diagrams_info:
+        diagrams_info['Trace'].close()
+        diagrams_info['Trace'] = diagrams_info['Trace'].directory
+    return diagrams_info
+
+def eval_chain_statistics(diagrams_info : dict) -> dict :
+    """Summary of a single chain, stored in the merged result"""
+    blocking = diagrams_info['Blocking']
+    return {'Samples': blocking['Order'].counts[0],
+            'Thermalization': diagrams_info.get('Thermalization'),
+            'Precision': diagrams_info.get('Precision'),
+            'Mean_order': blocking['Order'].mean(),
+            'Order_error': blocking['Order'].standard_error(),
+            'Mean_energy': blocking['Energy'].mean(),
+            'Energy_error': blocking['Energy'].standard_error(),
+            'Mean_tau': blocking['Tau'].mean(),
+            'Tau_error': blocking['Tau'].standard_error()}
+
+def merge_blocking(chains_info : list) -> dict :
+    """Merge the blocking analysis of independent chains"""
+    blocking = copy.deepcopy(chains_info[0]['Blocking'])
+    for info in chains_info[1:]:
+        for name, accumulator in info['Blocking'].items():
+            blocking[name].merge(accumulator)
+    return blocking
+
+def merge_green(chains_info : list):
+    """Merge the Green's function estimators of independent chains"""
+    green = copy.deepcopy(chains_info[0]['Green'])
+    for info in chains_info[1:]:
+        green.merge(info['Green'])
+    return green
+
+def merge_updates(chains_info : list) -> dict :
+    """Sum the update counters of the chains"""
+    updates = copy.deepcopy(chains_info[0]['Updates'])
+    for info in chains_info[1:]:
+        for name, counters in info['Updates'].items():
+            for key, value in counters.items():
+                updates[name][key] += value
+    return updates
+
+def merge_precision(chains_info : list) -> dict :
+    """Outcome of the runs with a target error of the chains, the target
+    of the merged result is the one of each chain over sqrt(nchains)"""
+    precisions = [info['Precision'] for info in chains_info]
+    return {'Target_error': precisions[0]['Target_error']/math.sqrt(len(precisions)),
+            'Steps': sum(precision['Steps'] for precision in precisions),
+            'Precise': all(precision['Precise'] for precision in precisions),
+            'Wall_time': max(precision['Wall_time'] for precision in precisions)}
+
+def merge_diagrams_info(chains_info : list) -> dict :
+    """Merge the diagrams_info of each chain in a single dictionary with the
+    same keys, plus the list of per-chain statistics under 'Chains'"""
+    if 'Accumulator' in chains_info[0]:
+        accumulator = copy.deepcopy(chains_info[0]['Accumulator'])
+        for info in chains_info[1:]:
+            accumulator.merge(info['Accumulator'])
+        merged = {'Accumulator': accumulator,
+                  'Blocking': merge_blocking(chains_info),
+                  'Green': merge_green(chains_info),
+                  'Updates': merge_updates(chains_info),
+                  'Chains': [eval_chain_statistics(info) for info in chains_info]}
+    else:
+        merged = {'Order_sequence': np.concatenate([np.asarray(info['Order_sequence'])
+                                                    for info in chains_info]),
+                  'Energy_sequence': np.concatenate([np.asarray(info['Energy_sequence'])
+                                                     for info in chains_info]),
+                  'Blocking': merge_blocking(chains_info),
+                  'Green': merge_green(chains_info),
+                  'Updates': merge_updates(chains_info),
+                  'Chains': [eval_chain_statistics(info) for info in chains_info]}
+    if 'Precision' in chains_info[0]:
+        merged['Precision'] = merge_precision(chains_info)
+    if 'Trace' in chains_info[0]:
+        merged['Trace'] = [info['Trace'] for info in chains_info]
+    return merged
+
+def run_parallel_chains(args : argparse.Namespace) -> dict :
+    """Input parameter:
+    - args : list that contains the fundamental parameters for the simulation
+    Run args.nchains chains on args.nworkers processes and merge the results.
+    With args.target_error each chain aims at sqrt(nchains) times the
+    target, so that the merged result meets it
+    """
+    seeds = spawn_seeds(args.seed, args.nchains)
+    chain_args = args
+    if args.target_error is not None:
+        chain_args = argparse.Namespace(**vars(args))
+        chain_args.target_error = args.target_error*math.sqrt(args.nchains)
+    with ProcessPoolExecutor(max_workers=args.nworkers) as executor:
+        chains_info = list(executor.map(run_chain, [chain_args]*args.nchains, seeds,
+                                        range(args.nchains)))
+    return merge_diagrams_info(chains_info)
@@ -1,9 +1,11 @@
 """Module that contains utilities functions to display plots and useful
-quantities"""
+quantities. matplotlib is imported only by the plotting functions, so the
+analysis can run on machines without it"""
 
+import os
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
+from accumulators import GreenFunctionAccumulator, StreamingAccumulator
+from trace_writer import open_trace
 
 def eval_mean_energy(energy_sequence : list) -> float :
     """Parameters: energy_sequence, list of energy evaluated for each
@@ -18,6 +20,83 @@ def eval_mean_order(order_sequence : list) -> float :
     """
     return np.mean(np.array(order_sequence))
 
+def eval_error_analysis(blocking : dict) -> dict :
+    """Parameters: blocking, dictionary of BlockingAccumulator for order,
+    energy and tau
+    Return: for each observable the mean, the standard error, the integrated
+    autocorrelation time, the effective sample size and whether the blocking
+    analysis reached its plateau
+    """
+    return {name: {'Mean': accumulator.mean(),
+                   'Standard_error': accumulator.standard_error(),
+                   'Autocorrelation_time': accumulator.autocorrelation_time(),
+                   'Effective_samples': accumulator.effective_samples(),
+                   'Converged': accumulator.is_converged()}
+            for name, accumulator in blocking.items()}
+
+def print_error_analysis(blocking : dict):
+    """Print the blocking analysis of each observable"""
+    print(f"{'Observable':<10} {'Mean':>14} {'Std. error':>12} "
+          f"{'tau_int':>10} {'Eff. samples':>14} {'Converged':>10}")
+    for name, analysis in eval_error_analysis(blocking).items():
+        print(f"{name:<10} {analysis['Mean']:>14.6f} {analysis['Standard_error']:>12.3e} "
+              f"{analysis['Autocorrelation_time']:>10.2f} "
+              f"{analysis['Effective_samples']:>14.1f} "
+              f"{'yes' if analysis['Converged'] else 'no':>10}")
+
+def print_update_statistics(updates : dict):
+    """Print for each update how many times it was proposed, its acceptance
+    and rejection rates, the number of numerically extreme proposals and the
+    mean time of the timed calls"""
+    print(f"{'Update':<22} {'Proposed':>12} {'Accepted':>9} {'Rejected':>9} "
+          f"{'Extreme':>9} {'Time/call':>11}")
+    for name, counters in updates.items():
+        proposed = max(counters['Proposed'], 1)
+        time_label = '-'
+        if counters['Timed']:
+            time_label = f"{counters['Time']/counters['Timed']*1e6:.2f}us"
+        print(f"{name:<22} {counters['Proposed']:>12} "
+              f"{counters['Accepted']/proposed:>9.2%} {counters['Rejected']/proposed:>9.2%} "
+              f"{counters['Extreme']:>9} {time_label:>11}")
+
+def print_thermalization(thermalization : dict):
+    """Print the outcome of the adaptive thermalization"""
+    outcome = 'stationary' if thermalization['Stationary'] else 'not stationary'
+    windows = 'autocorrelation not converged'
+    if thermalization['Window_steps']:
+        windows = f"drift windows of {thermalization['Window_steps']} steps"
+    print(f"Thermalization: {thermalization['Steps']} steps, {outcome}, {windows}, "
+          f"tau window {thermalization['Tau_window']:.4f}")
+
+def print_precision(precision : dict):
+    """Print the outcome of a run with a target error"""
+    outcome = 'reached' if precision['Precise'] else 'not reached'
+    print(f"Target relative error {precision['Target_error']:.3g} {outcome} after "
+          f"{precision['Steps']} steps in {precision['Wall_time']:.1f} s")
+
+def load_trace_info(trace_dirs, max_time : float, tau_bins : int = 50,
+                    chunk_size : int = 1 << 20, mu : float = 0.0,
+                    green_batch : int = 1000) -> dict :
+    """Parameters: trace_dirs, directory written by a TraceWriter or list
+    of the directories of the chains of a run
+    Return: diagrams_info with a StreamingAccumulator and the Green's
+    function estimator filled from the memory mapped traces one chunk at a
+    time, so the traces are never loaded whole
+    """
+    if isinstance(trace_dirs, str):
+        trace_dirs = [trace_dirs]
+    accumulator = StreamingAccumulator(max_time, tau_bins)
+    green = GreenFunctionAccumulator(max_time, mu, tau_bins, green_batch)
+    for trace_dir in trace_dirs:
+        trace = open_trace(trace_dir)
+        for start in range(0, len(trace['Order']), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            orders = np.asarray(trace['Order'][chunk], dtype=np.int64)
+            accumulator.push_arrays(orders, np.asarray(trace['Energy'][chunk]),
+                                    np.asarray(trace['Tau'][chunk]))
+            green.push_arrays(orders, np.asarray(trace['Tau'][chunk]))
+    return {'Accumulator': accumulator, 'Green': green}
+
 def get_bins_edges(order_sequence : list) -> list:
     """Return a list of left bin edges and right edge of last bin.
     Each bin is centered on each of the possible values"""
@@ -25,51 +104,99 @@ def get_bins_edges(order_sequence : list) -> list:
     bins_edges = np.arange(n_bins+1) - 0.5
     return bins_edges
 
-def plot_montecarlo(diagrams_info : dict):
-    """ Allow use of LaTeX font in graphics
-        Return an histogram:
+def get_pyplot(show : bool = False, usetex : bool = False):
+    """Import pyplot on first use. Unless the figures are shown the headless
+    Agg backend is selected, and LaTeX renders the text only with usetex"""
+    import matplotlib
+    if not show:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.rcParams['text.usetex'] = usetex
+    return plt
+
+def plot_montecarlo(diagrams_info : dict, directory : str = '.', show : bool = False,
+                    usetex : bool = False):
+    """ Save in directory, and show if requested:
+        an histogram:
        -optimized binning divisions
        -occurrences for each bin are normalized to the number of samples
        -plot the sampled probability distribution vs the analitycal one
+    If diagrams_info holds a StreamingAccumulator the histogram and the mean
+    values are taken from it
     """
-    plt.rcParams['text.usetex'] = True
-    n , bins, patches = plt.hist(x=diagrams_info['Order_sequence'], density=True,
-                        bins=get_bins_edges(diagrams_info['Order_sequence']),
-                        ec='black', fc='blue', alpha=0.8)
+    plt = get_pyplot(show, usetex)
+    from matplotlib.lines import Line2D
+    plt.figure()
+    if 'Accumulator' in diagrams_info:
+        accumulator = diagrams_info['Accumulator']
+        orders = np.arange(accumulator.max_order() + 1)
+        n , bins, patches = plt.hist(x=orders, density=True,
+                            weights=accumulator.order_histogram[:len(orders)],
+                            bins=get_bins_edges(orders),
+                            ec='black', fc='blue', alpha=0.8)
+        mean_order = accumulator.order.mean
+        mean_energy = accumulator.energy.mean
+    else:
+        n , bins, patches = plt.hist(x=diagrams_info['Order_sequence'], density=True,
+                            bins=get_bins_edges(diagrams_info['Order_sequence']),
+                            ec='black', fc='blue', alpha=0.8)
+        mean_order = eval_mean_order(diagrams_info['Order_sequence'])
+        mean_energy = eval_mean_energy(diagrams_info['Energy_sequence'])
 
     """Define labels entry for legend"""
-    mean_order = eval_mean_order(diagrams_info['Order_sequence'])
     order_label = 'Mean diagram order: ' + f'{mean_order:.5f}'
-
-    mean_energy = eval_mean_energy(diagrams_info['Energy_sequence'])
+    if 'Blocking' in diagrams_info:
+        order_label += f' $\\pm$ {diagrams_info["Blocking"]["Order"].standard_error():.5f}'
     energy_label = 'Mean energy: ' + f'{mean_energy:.5f}'
+    if 'Blocking' in diagrams_info:
+        energy_label += f' $\\pm$ {diagrams_info["Blocking"]["Energy"].standard_error():.5f}'
 
-    invalid_diagrams = diagrams_info['Invalid_diagrams']
-    inv_diag_label = 'Number of invalid diagrams: ' + f'{invalid_diagrams}'
     legend_elements = [Line2D([0], [0], color='b', label=order_label),
-                       Line2D([0], [0], color='r', label=energy_label),
-                       Line2D([0], [0], color='g', label=inv_diag_label)]
+                       Line2D([0], [0], color='r', label=energy_label)]
 
     plt.xlabel('Diagram order')
     plt.ylabel(r'Sampled probability distribution')
     plt.yscale("log")
     plt.legend(handles=legend_elements)
-    plt.savefig("DiagramOrderDistribution.png")
-    plt.show()
+    plt.savefig(os.path.join(directory, "DiagramOrderDistribution.png"))
+    if show:
+        plt.show()
+    plt.close()
 
-def plot_green_function(tau_sequence : list):
-    """ Allow use of LaTeX font in graphics
-        Return an histogram:
-       -optimized binning divisions
-       -occurrences for each bin are normalized to the number of samples
-       -plot the sampled probability distribution vs the analitycal one
+def print_green_function_fit(green, energy_blocking, fit_start : float = None):
+    """Print the ground state energy and Z factor fitted on the tail of the
+    Green's function, next to the energy estimator of the diagrams shifted
+    by the electron energy mu, which enters only the bare propagator"""
+    fit = green.fit_exponential_tail(fit_start)
+    print(f"Green's function fit over {fit['Bins']} bins with tau >= {fit['Fit_start']:.3f}")
+    print(f"{'Energy (fit)':<18} {fit['Energy']:>14.6f} +- {fit['Energy_error']:.3e}")
+    print(f"{'Energy (mean + mu)':<18} {energy_blocking.mean() + green.mu:>14.6f} "
+          f"+- {energy_blocking.standard_error():.3e}")
+    print(f"{'Z factor':<18} {fit['Z']:>14.6f} +- {fit['Z_error']:.3e}")
+
+def plot_green_function(green, fit_start : float = None, directory : str = '.',
+                        show : bool = False, usetex : bool = False):
+    """ Save in directory, and show if requested:
+        the Green's function G(tau) accumulated during the sampling
+        with the batch means error bars of each bin and the exponential
+        fitted on its tail
     """
-    plt.rcParams['text.usetex'] = True
-    plt.hist(x=tau_sequence, density=True, bins=50,
-             ec='black', fc='blue', alpha=0.8, label=r"Sampled $G(\tau)$")
+    plt = get_pyplot(show, usetex)
+    plt.figure()
+    taus, green_function, errors = green.green_function()
+    plt.errorbar(taus, green_function, yerr=errors, fmt='o', color='blue',
+                 markersize=3, label=r"Sampled $G(\tau)$")
+    fit = green.fit_exponential_tail(fit_start)
+    if not np.isnan(fit['Energy']):
+        tail = taus[taus >= fit['Fit_start']]
+        plt.plot(tail, fit['Z']*np.exp(-fit['Energy']*tail), color='red',
+                 label=f"$Z e^{{-E\\tau}}$, $E$ = {fit['Energy']:.4f}, $Z$ = {fit['Z']:.4f}")
 
     plt.xlabel(r'Lifetime $(\tau)$')
     plt.ylabel(r'$G(\tau)$')
+    plt.yscale("log")
     plt.legend()
-    plt.savefig("GreenFunctionHistogram.png")
-    plt.show()
+    plt.savefig(os.path.join(directory, "GreenFunctionHistogram.png"))
+    if show:
+        plt.show()
+    plt.close()
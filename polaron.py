@@ -1,30 +1,86 @@
-import random
+import bisect
+import math
 import numpy as np
 import argparse
+from accumulators import BlockingAccumulator, GreenFunctionAccumulator, StreamingAccumulator
+from random_source import RandomSource
+
+LOG_FLOAT_MAX = math.log(np.finfo(np.float64).max)
+
+def safe_log(value : float) -> float :
+    """Natural logarithm that returns -inf at zero instead of raising"""
+    if value > 0:
+        return math.log(value)
+    return -math.inf
 
 class Polaron:
-    def __init__(self, args: argparse.Namespace):
+    def __init__(self, args: argparse.Namespace, random_source : RandomSource = None):
+        """All the random numbers of the chain are drawn from random_source,
+        if it is not given a new one is seeded with args.seed"""
+        if random_source is None:
+            random_source = RandomSource(args.seed)
+        self.random_source = random_source
         self.create_initial_diagram(args)
+        for _ in range(args.order):
+            self.add_internal(self.generate_phonon())
         self.set_zero_order_updates()
         self.set_updates()
-        self.set_diagrams_info()
+        self.set_update_weights(1.0, 1.0, args.shift_weight)
+        self.set_diagrams_info(args)
 
     def create_initial_diagram(self, args : argparse.Namespace):
         """Produce initial diagram for Holstein polaron in the tight
         binding limit.
         Default value are provided if the user does not write
-        command line values for the simulation parameters
+        command line values for the simulation parameters.
+        The diagram has no phonons, the args.order phonons of the initial
+        diagram are drawn by the constructor with generate_phonon
         """
-        self.diagram = {'order': args.order,
+        self.diagram = {'order': 0,
                    'phonon_energy': args.omega,
                    'phonon_list': [],
+                   'vertex_times': None,
                    'electron_energy': args.mu,
                    'electron_gen_time': 0,
                    'electron_rem_time': 1,
                    'ep_coupling': args.g,
                    'time_scaling': args.time_scaling,
                    'max_time': args.max_time,
-                   'total_energy': 0}
+                   'tau_window': float(args.max_time),
+                   'phonons_time': 0.0,
+                   'total_energy': 0,
+                   'energy_outdated': False}
+
+    def get_diagram_state(self) -> dict :
+        """Phonon times, order, lifetime of the electron and running totals
+        of the current diagram as a dictionary of arrays"""
+        phonon_list = self.diagram['phonon_list']
+        return {'gen_times': np.array([phonon['gen_time'] for phonon in phonon_list],
+                                      dtype=np.float64),
+                'rem_times': np.array([phonon['rem_time'] for phonon in phonon_list],
+                                      dtype=np.float64),
+                'order': np.array(self.diagram['order']),
+                'time_scaling': np.array(self.diagram['time_scaling']),
+                'phonons_time': np.array(self.diagram['phonons_time']),
+                'total_energy': np.array(self.diagram['total_energy']),
+                'energy_outdated': np.array(self.diagram['energy_outdated']),
+                'tau_window': np.array(self.diagram['tau_window']),
+                'update_weights': np.array(self.update_weights, dtype=np.float64)}
+
+    def set_diagram_state(self, state : dict):
+        """Replace the current diagram with a state returned by
+        get_diagram_state, the physical parameters are left unchanged"""
+        self.diagram['phonon_list'] = [{'gen_time': t_gen, 'rem_time': t_rem}
+                                       for t_gen, t_rem in zip(state['gen_times'].tolist(),
+                                                               state['rem_times'].tolist())]
+        self.diagram['vertex_times'] = None
+        self.diagram['order'] = int(state['order'])
+        self.diagram['time_scaling'] = float(state['time_scaling'])
+        self.diagram['phonons_time'] = float(state['phonons_time'])
+        self.diagram['total_energy'] = float(state['total_energy'])
+        self.diagram['energy_outdated'] = bool(state['energy_outdated'])
+        self.diagram['tau_window'] = float(state['tau_window'])
+        self.set_update_weights(*state['update_weights'].tolist())
 
     def set_zero_order_updates(self):
         """Fill the list of possible updates to a zero order diagram"""
@@ -33,195 +89,335 @@ class Polaron:
     def set_updates(self):
         """Fill the list of possible updates to the diagram"""
         self.updates = [self.eval_add_internal, self.eval_remove_internal,
-                        self.eval_change_tau]
-
-    def set_diagrams_info(self):
-        """Set the initial values for diagram's info like initial order,
-        energy and number of invalid diagrams"""
-        self.diagrams_info = {'Order_sequence' : [],
-                             'Energy_sequence': [],
-                             'Tau_sequence' : [],
-                             'Invalid_diagrams': 0}
-
-    def metropolis(self, prob):
-        """Using metropolis choice we ensure detailed balance for Markov chain"""
-        return min(1, prob)
-
-    def add_phonon_scaling(self):
-        """Evaluate scaling parameter due to electron phonon coupling"""
-        return (self.diagram['ep_coupling']*self.diagram['time_scaling'])**2
-
-    def weigth_ratio_add(self, phonon):
-        """Evaluate weigth_ratio between proposed and current Feynman diagram"""
-        phonon_propagator = np.exp(-self.diagram['time_scaling']*self.diagram['phonon_energy'] *
-                            (phonon['rem_time'] - phonon['gen_time']))
-        if abs(self.add_phonon_scaling()*phonon_propagator) == 0.0:
-            raise ValueError("Underflow error in evaluating phonon propagator\n")
-
-        return self.add_phonon_scaling()*phonon_propagator
-
-    def proposal_add_ratio(self, phonon):
-        """Evaluate ratio between p_reverse and p_current
+                        self.eval_change_tau, self.eval_shift_vertex]
+
+    def set_update_weights(self, add_remove_weight : float, change_tau_weight : float,
+                           shift_vertex_weight : float = 0.0):
+        """Set the relative probabilities of choosing each update. Add and
+        remove share the same weight so that their proposal probabilities
+        cancel in the acceptance ratio. With equal weights the update is
+        chosen with randrange, otherwise the cumulative probabilities of
+        both update lists are stored.
+        log_zero_order_selection is the log of the probability of choosing
+        remove from a first order diagram over the one of choosing add from
+        a zero order diagram.
+        The time ordered vertex_times read by eval_shift_vertex are kept only
+        while its weight is positive, otherwise they are None and add and
+        remove do not pay for their upkeep. They are a sorted list: a vertex
+        is found by bisection, but inserting or deleting one moves the
+        following entries, so add and remove cost O(order) with the shift
+        update on"""
+        self.update_weights = (add_remove_weight, change_tau_weight, shift_vertex_weight)
+        if shift_vertex_weight <= 0:
+            self.diagram['vertex_times'] = None
+        elif self.diagram['vertex_times'] is None:
+            self.diagram['vertex_times'] = sorted(
+                [phonon['gen_time'] for phonon in self.diagram['phonon_list']] +
+                [phonon['rem_time'] for phonon in self.diagram['phonon_list']])
+        self.log_zero_order_selection = math.log(
+            (add_remove_weight + change_tau_weight) /
+            (2*add_remove_weight + change_tau_weight + shift_vertex_weight))
+        if add_remove_weight == change_tau_weight == shift_vertex_weight:
+            self.zero_order_cumulative = None
+            self.cumulative = None
+            return
+        zero_order = np.array([add_remove_weight, change_tau_weight])
+        weights = np.array([add_remove_weight, add_remove_weight, change_tau_weight,
+                            shift_vertex_weight])
+        self.zero_order_cumulative = (np.cumsum(zero_order)/zero_order.sum()).tolist()
+        self.cumulative = (np.cumsum(weights)/weights.sum()).tolist()
+
+    def choose_update(self):
+        """Draw one of the updates allowed for the current diagram according
+        to the update weights"""
+        if self.diagram['order'] == 0:
+            updates, cumulative = self.zero_order_updates, self.zero_order_cumulative
+        else:
+            updates, cumulative = self.updates, self.cumulative
+        if cumulative is None:
+            return updates[self.random_source.randrange(len(updates))]
+        value = self.random_source.uniform()
+        for update, threshold in zip(updates, cumulative):
+            if value < threshold:
+                return update
+        return updates[-1]
+
+    def set_diagrams_info(self, args : argparse.Namespace):
+        """Set the initial values for diagram's info like initial order
+        and energy.
+        In accumulator mode the sequences are replaced by a constant memory
+        StreamingAccumulator. In both modes the blocking analysis of order,
+        energy and lifetime is updated on the fly, as the binned estimator
+        of the Green's function under 'Green'.
+        'Updates' counts for each update how many times it is proposed,
+        accepted, rejected or numerically extreme, and the time spent
+        in the timed calls"""
+        if args.accumulate:
+            self.diagrams_info = {'Accumulator': StreamingAccumulator(args.max_time,
+                                                                      args.tau_bins)}
+        else:
+            self.diagrams_info = {'Order_sequence' : [],
+                                 'Energy_sequence': []}
+        self.diagrams_info['Updates'] = {update.__name__: {'Proposed': 0, 'Accepted': 0,
+                                                           'Rejected': 0, 'Extreme': 0,
+                                                           'Timed': 0, 'Time': 0.0}
+                                         for update in self.updates}
+        self.diagrams_info['Blocking'] = {'Order': BlockingAccumulator(),
+                                          'Energy': BlockingAccumulator(),
+                                          'Tau': BlockingAccumulator()}
+        self.diagrams_info['Green'] = GreenFunctionAccumulator(args.max_time, args.mu,
+                                                               args.tau_bins, args.green_batch)
+
+    def log_metropolis(self, log_ratio : float, update_name : str) -> bool :
+        """Using metropolis choice we ensure detailed balance for Markov chain.
+        The test is performed in log space, the update is accepted if
+        log(uniform) < log_ratio, so it never overflows. Proposals whose ratio
+        would be out of the float range are counted as 'Extreme' in the
+        counters of the update, a nan ratio is rejected"""
+        if not -LOG_FLOAT_MAX < log_ratio < LOG_FLOAT_MAX:
+            self.diagrams_info['Updates'][update_name]['Extreme'] += 1
+        if log_ratio >= 0:
+            return True
+        return math.log1p(-self.random_source.uniform()) < log_ratio
+
+    def log_add_phonon_scaling(self):
+        """Evaluate the log of the scaling parameter due to electron phonon
+        coupling"""
+        return 2*safe_log(abs(self.diagram['ep_coupling']*self.diagram['time_scaling']))
+
+    def log_removal_time_prob(self, phonon):
+        """Log of the exponential probability density of the removal time of
+        a phonon given its generation time, uniform for a zero phonon energy"""
+        alpha = self.diagram['phonon_energy']*self.diagram['time_scaling']
+        if alpha == 0:
+            return -math.log1p(-phonon['gen_time'])
+        log_normalization = safe_log(alpha) - \
+            safe_log(-math.expm1(-alpha*(1-phonon['gen_time'])))
+        return log_normalization - alpha*(phonon['rem_time']-phonon['gen_time'])
+
+    def log_weigth_ratio_add(self, phonon):
+        """Evaluate the log of weigth_ratio between proposed and current
+        Feynman diagram"""
+        return self.log_add_phonon_scaling() - \
+            self.diagram['time_scaling']*self.diagram['phonon_energy'] * \
+            (phonon['rem_time'] - phonon['gen_time'])
+
+    def log_proposal_add_ratio(self, phonon):
+        """Evaluate the log of the ratio between p_reverse and p_current
         i.e. removing the phonon added and adding it for the
         current update.
         p_current: uniform gen_time between 0 and 1 *
-        uniform rem_time between gen_time and 1
+        exponential rem_time between gen_time and 1, see log_removal_time_prob
         p_reverse: removal of the phonon whose probability is 1/(# of phonons)
+        From a zero order diagram the probabilities of choosing the add and
+        the reverse remove update differ
         """
-        alpha = self.diagram['phonon_energy']*self.diagram['time_scaling']
-        normalization = alpha/(1-np.exp(-alpha*(1-phonon['gen_time'])))
-        removal_time_prob = normalization * \
-                        np.exp(-alpha*(phonon['rem_time']-phonon['gen_time']))
-        return 1/((self.diagram['order']+1)*removal_time_prob)
+        log_ratio = -safe_log(self.diagram['order']+1) - self.log_removal_time_prob(phonon)
+        if self.diagram['order'] == 0:
+            log_ratio += self.log_zero_order_selection
+        return log_ratio
 
     def add_internal(self, phonon):
-        """Add a phonon to the diagram and update the order"""
+        """Add a phonon to the diagram and update the order and the total
+        time of the phonon propagators"""
         self.diagram['phonon_list'].append(phonon)
+        if self.diagram['vertex_times'] is not None:
+            bisect.insort(self.diagram['vertex_times'], phonon['gen_time'])
+            bisect.insort(self.diagram['vertex_times'], phonon['rem_time'])
         self.diagram['order'] += 1
+        self.diagram['phonons_time'] += phonon['rem_time'] - phonon['gen_time']
+        self.diagram['energy_outdated'] = True
 
     def eval_add_internal(self):
         """Evaluate acceptance probability of internal phonon propagator and eventually
-        add it to the diagram"""
+        add it to the diagram. Return True if the update is accepted"""
         phonon = self.generate_phonon()
-        try:
-            ratio_acceptance_probs = self.weigth_ratio_add(phonon) * \
-                self.proposal_add_ratio(phonon)
-        except ValueError as error:
-            print(f"ValueError: {error}, {error.__class__}")
-            raise ValueError("Add internal will not be performed in DMC") from error
-
-        acceptance = self.metropolis(ratio_acceptance_probs)
-        if acceptance == 1:
+        log_ratio = self.log_weigth_ratio_add(phonon) + self.log_proposal_add_ratio(phonon)
+        if self.log_metropolis(log_ratio, 'eval_add_internal'):
             self.add_internal(phonon)
-        elif 0 <= acceptance < 1:
-            sample = np.random.uniform()
-            if sample <= acceptance:
-                self.add_internal(phonon)
+            return True
+        return False
 
     def generate_phonon(self) -> dict:
-        """Produce phonon propagator extracting scaled generation
-        and removal time from uniform distribution.
+        """Produce phonon propagator extracting scaled generation time from
+        uniform distribution and removal time from the exponential density
+        truncated at 1 of log_removal_time_prob, by inversion of its
+        cumulative distribution. Without phonon energy the density is
+        uniform between gen_time and 1.
         """
-        t_gen = np.random.uniform(0, 1)
-        t_rem = np.random.uniform(t_gen, 1)
-        return {'gen_time': t_gen, 'rem_time': t_rem}
+        t_gen = self.random_source.uniform(0, 1)
+        alpha = self.diagram['phonon_energy']*self.diagram['time_scaling']
+        if alpha == 0:
+            return {'gen_time': t_gen,
+                    'rem_time': t_gen + self.random_source.uniform()*(1 - t_gen)}
+        span = -math.expm1(-alpha*(1 - t_gen))
+        t_rem = t_gen - math.log1p(-self.random_source.uniform()*span)/alpha
+        return {'gen_time': t_gen, 'rem_time': min(t_rem, 1.0)}
 
     def get_phonon(self) -> tuple :
         """Retrieve randomly a phonon from the one in the diagram"""
-        phonon_tag = random.randrange(len(self.diagram['phonon_list']))
+        phonon_tag = self.random_source.randrange(len(self.diagram['phonon_list']))
         return (self.diagram['phonon_list'][phonon_tag], phonon_tag)
 
-    def weigth_ratio_remove(self, phonon):
-        """Evaluate weigth_ratio between proposed and current Feynman diagram"""
-        phonon_propagator = np.exp(self.diagram['time_scaling']*self.diagram['phonon_energy']*
-                                (phonon['rem_time'] - phonon['gen_time']))
-        if np.isinf(phonon_propagator/self.add_phonon_scaling()) is True:
-            raise ValueError("Overflow Error in evaluating phonon propagator\n")
+    def log_weigth_ratio_remove(self, phonon):
+        """Evaluate the log of weigth_ratio between proposed and current
+        Feynman diagram"""
+        return self.diagram['time_scaling']*self.diagram['phonon_energy'] * \
+            (phonon['rem_time'] - phonon['gen_time']) - self.log_add_phonon_scaling()
 
-        return phonon_propagator/self.add_phonon_scaling()
-
-    def proposal_remove_ratio(self, phonon):
-        """Evaluate ratio between p_reverse and p_current
+    def log_proposal_remove_ratio(self, phonon):
+        """Evaluate the log of the ratio between p_reverse and p_current
         i.e. adding the considered phonon and removing it
         p_current: uniform gen_time between 0 and 1 *
-        uniform rem_time between gen_time and 1
+        exponential rem_time between gen_time and 1, see log_removal_time_prob
         p_reverse: removal of the phonon whose probability is 1/(# of phonons)
+        To a zero order diagram the probabilities of choosing the remove and
+        the reverse add update differ
         """
-        alpha = self.diagram['phonon_energy']*self.diagram['time_scaling']
-        normalization = alpha/(1-np.exp(-alpha*(1-phonon['gen_time'])))
-        removal_time_prob = normalization *  \
-                        np.exp(-alpha*(phonon['rem_time']-phonon['gen_time']))
-        return self.diagram['order']*removal_time_prob
+        log_ratio = safe_log(self.diagram['order']) + self.log_removal_time_prob(phonon)
+        if self.diagram['order'] == 1:
+            log_ratio -= self.log_zero_order_selection
+        return log_ratio
 
     def remove_internal(self, phonon_tag):
-        """Remove a phonon to the diagram and update the order"""
-        del self.diagram['phonon_list'][phonon_tag]
+        """Remove a phonon to the diagram and update the order and the total
+        time of the phonon propagators. The removed phonon is replaced by the
+        last one of the list so that the removal is O(1), vertex_times, when
+        the shift update keeps it, costs a memmove of the list
+        The running total is reset when the last phonon is removed so that
+        rounding errors do not pile up along the chain"""
+        phonon_list = self.diagram['phonon_list']
+        phonon = phonon_list[phonon_tag]
+        phonon_list[phonon_tag] = phonon_list[-1]
+        phonon_list.pop()
+        vertex_times = self.diagram['vertex_times']
+        if vertex_times is not None:
+            del vertex_times[bisect.bisect_left(vertex_times, phonon['gen_time'])]
+            del vertex_times[bisect.bisect_left(vertex_times, phonon['rem_time'])]
         self.diagram['order'] -= 1
+        if phonon_list:
+            self.diagram['phonons_time'] -= phonon['rem_time'] - phonon['gen_time']
+        else:
+            self.diagram['phonons_time'] = 0.0
+        self.diagram['energy_outdated'] = True
 
     def eval_remove_internal(self):
         """Choose one of the phonons randomly and evaluate
-        the acceptance probability for the removal update
+        the acceptance probability for the removal update.
+        Return True if the update is accepted
         """
         phonon, phonon_tag = self.get_phonon()
-        try:
-            ratio_acceptance_probs = self.weigth_ratio_remove(phonon) * \
-                self.proposal_remove_ratio(phonon)
-        except ValueError as error:
-            print(f"ValueError: {error}, {error.__class__}")
-            raise ValueError("Remove internal will not be performed in DMC") from error
-
-        acceptance = self.metropolis(ratio_acceptance_probs)
-        if acceptance == 1:
+        log_ratio = self.log_weigth_ratio_remove(phonon) + \
+            self.log_proposal_remove_ratio(phonon)
+        if self.log_metropolis(log_ratio, 'eval_remove_internal'):
             self.remove_internal(phonon_tag)
-        elif 0 <= acceptance < 1 :
-            sample = np.random.uniform()
-            if sample <= acceptance:
-                self.remove_internal(phonon_tag)
+            return True
+        return False
+
+    def get_vertex_neighbours(self, time : float) -> tuple :
+        """Position of a vertex in the time ordered vertex_times and the times
+        of the vertices before and after it, 0 and 1 at the ends of the
+        electron propagator"""
+        vertex_times = self.diagram['vertex_times']
+        index = bisect.bisect_left(vertex_times, time)
+        lower = vertex_times[index - 1] if index > 0 else 0.0
+        upper = vertex_times[index + 1] if index + 1 < len(vertex_times) else 1.0
+        return index, lower, upper
+
+    def eval_shift_vertex(self):
+        """Choose randomly one of the phonons and one of its ends, and move
+        that vertex uniformly between the vertices before and after it.
+        The move keeps the time order of the vertices, so the interval of the
+        reverse move is the same and the proposal is symmetric, only the
+        propagator of the phonon changes. Return True if the update is
+        accepted
+        """
+        phonon, _ = self.get_phonon()
+        end = ('gen_time', 'rem_time')[self.random_source.randrange(2)]
+        index, lower, upper = self.get_vertex_neighbours(phonon[end])
+        new_time = self.random_source.uniform(lower, upper)
+        length_change = new_time - phonon[end]
+        if end == 'gen_time':
+            length_change = -length_change
+        log_ratio = -self.diagram['time_scaling']*self.diagram['phonon_energy']*length_change
+        if self.log_metropolis(log_ratio, 'eval_shift_vertex'):
+            phonon[end] = new_time
+            self.diagram['vertex_times'][index] = new_time
+            self.diagram['phonons_time'] += length_change
+            self.diagram['energy_outdated'] = True
+            return True
+        return False
 
     def change_tau(self, new_tau):
         """Change the lifetime of the electron"""
         self.diagram['time_scaling'] = new_tau
+        self.diagram['energy_outdated'] = True
 
-    def weigth_ratio_change_tau(self, new_tau):
-        """Ratio between a proposed Feynman diagram with a different lifetime for
-        the quasiparticle and the current one.
-        First we evaluate the ratio between the time_scaling that appear
-        inside the integrals from the use of internal scaled time. Then we evaluate
-        the ratio between the propagators that figures out in the diagram"""
-        time_ratio = (new_tau/self.diagram['time_scaling'])** \
-                     (2*len(self.diagram['phonon_list']))
-
-        sum_phonons_time = 0
-        for phonon in self.diagram['phonon_list']:
-            sum_phonons_time += (phonon['rem_time'] - phonon['gen_time'])
-
-        propagators_ratio = np.exp(-(new_tau - self.diagram['time_scaling']) * \
-                    (self.diagram['phonon_energy']*sum_phonons_time + \
-                     self.diagram['electron_energy']))
+    def log_weigth_ratio_change_tau(self, new_tau):
+        """Log of the ratio between the weights of a proposed Feynman
+        diagram with a different lifetime for the quasiparticle and the
+        current one. Besides the propagators each phonon carries the factor
+        (g*tau)**2 of add_phonon_scaling, since its times are scaled by tau"""
+        return -(new_tau - self.diagram['time_scaling']) * \
+            (self.diagram['phonon_energy']*self.diagram['phonons_time'] +
+             self.diagram['electron_energy']) + \
+            2*self.diagram['order']*math.log(new_tau/self.diagram['time_scaling'])
 
-        if np.isinf(time_ratio*propagators_ratio) is True:
-            raise ValueError("""Overflow Error in evaluating weight ratio for
-                                change tau update \n""")
-        if abs(time_ratio*propagators_ratio) == 0.0:
-            raise ValueError("""Underflow error in evaluating weight ratio for
-                                change tau update \n""")
-
-        return propagators_ratio
+    def propose_tau(self) -> float :
+        """New lifetime of the electron, drawn uniformly in [0, max_time] or,
+        if tau_window is smaller than max_time, uniformly in a window of that
+        width centered on the current one. Both proposals are symmetric"""
+        if self.diagram['tau_window'] >= self.diagram['max_time']:
+            return self.random_source.uniform(0, self.diagram['max_time'])
+        half_window = 0.5*self.diagram['tau_window']
+        return self.diagram['time_scaling'] + self.random_source.uniform(-half_window,
+                                                                         half_window)
 
     def eval_change_tau(self):
-        """Choose one of the phonons randomly and evaluate
-        the acceptance probability for the removal update
+        """Propose a new lifetime of the electron and evaluate the
+        acceptance probability for the change. Return True if the update is
+        accepted, a lifetime out of [0, max_time] is rejected
         """
-        new_tau = np.random.uniform(0, self.diagram['max_time'])
+        new_tau = self.propose_tau()
         while new_tau == self.diagram['time_scaling']:
-            new_tau = np.random.uniform(0, self.diagram['max_time'])
-        try:
-            ratio_acceptance_probs = self.weigth_ratio_change_tau(new_tau)
-        except ValueError as error:
-            print(f"ValueError: {error}, {error.__class__}")
-            raise ValueError("Remove internal will not be performed in DMC") from error
-
-        acceptance = self.metropolis(ratio_acceptance_probs)
-        if acceptance == 1:
+            new_tau = self.propose_tau()
+        if not 0 < new_tau <= self.diagram['max_time']:
+            return False
+        log_ratio = self.log_weigth_ratio_change_tau(new_tau)
+        if self.log_metropolis(log_ratio, 'eval_change_tau'):
             self.change_tau(new_tau)
-        elif 0 <= acceptance < 1 :
-            sample = np.random.uniform()
-            if sample <= acceptance:
-                self.change_tau(new_tau)
+            return True
+        return False
 
     def eval_diagram_energy(self):
-        """Evaluate energy of the system at a certain iteration"""
+        """Evaluate energy of the system at a certain iteration.
+        The cached value is kept if the diagram did not change since the
+        last evaluation"""
+        if not self.diagram['energy_outdated']:
+            return
         if self.diagram['order'] == 0:
             self.diagram['total_energy'] = 0
         else:
-            energy = 0
-            for phonon in self.diagram['phonon_list']:
-                energy += self.diagram['phonon_energy']*(phonon['rem_time']-phonon['gen_time'])
+            energy = self.diagram['phonon_energy']*self.diagram['phonons_time']
             energy = (energy - self.diagram['order'])/self.diagram['time_scaling']
             self.diagram['total_energy'] = energy
+        self.diagram['energy_outdated'] = False
 
     def update_diagrams_info(self):
         """Update lists of diagrams order, energy and lifetime of the electron"""
-        self.diagrams_info['Order_sequence'].append(self.diagram['order'])
-        self.diagrams_info['Energy_sequence'].append(self.diagram['total_energy'])
-        self.diagrams_info['Tau_sequence'].append(self.diagram['time_scaling'])
+        blocking = self.diagrams_info['Blocking']
+        blocking['Order'].push(self.diagram['order'])
+        blocking['Energy'].push(self.diagram['total_energy'])
+        blocking['Tau'].push(self.diagram['time_scaling'])
+        self.diagrams_info['Green'].push(self.diagram['order'], self.diagram['time_scaling'])
+        if 'Trace' in self.diagrams_info:
+            self.diagrams_info['Trace'].push(self.diagram['order'],
+                                             self.diagram['total_energy'],
+                                             self.diagram['time_scaling'])
+        if 'Accumulator' in self.diagrams_info:
+            self.diagrams_info['Accumulator'].push(self.diagram['order'],
+                                                   self.diagram['total_energy'],
+                                                   self.diagram['time_scaling'])
+        else:
+            self.diagrams_info['Order_sequence'].append(self.diagram['order'])
+            self.diagrams_info['Energy_sequence'].append(self.diagram['total_energy'])
@@ -0,0 +1,49 @@
+"""Helper class that hands out random numbers to the Markov chain. Uniform
+samples are drawn in large blocks from a numpy Generator (PCG64) so that the
+cost of a numpy call is shared among many MonteCarlo steps."""
+
+import json
+import numpy as np
+
+BLOCK_SIZE = 8192
+
+class RandomSource:
+    def __init__(self, seed=None, block_size : int = BLOCK_SIZE):
+        """seed can be None, an integer or a numpy SeedSequence, the same
+        seed always reproduces the same stream"""
+        self.generator = np.random.Generator(np.random.PCG64(seed))
+        self.block_size = block_size
+        self.refill()
+
+    def refill(self):
+        """Draw a new block of uniform samples in [0, 1)"""
+        self.block = self.generator.random(self.block_size).tolist()
+        self.position = 0
+
+    def uniform(self, low : float = 0.0, high : float = 1.0) -> float :
+        """Return a sample from the uniform distribution in [low, high)"""
+        if self.position == self.block_size:
+            self.refill()
+        sample = self.block[self.position]
+        self.position += 1
+        return low + (high - low)*sample
+
+    def randrange(self, stop : int) -> int :
+        """Return a random integer in [0, stop)"""
+        if stop <= 0:
+            raise ValueError("empty range for randrange()")
+        return min(int(self.uniform()*stop), stop - 1)
+
+    def get_state(self) -> dict :
+        """State of the generator and of the current block as arrays, it
+        restores the exact stream with set_state"""
+        return {'bit_generator': np.array(json.dumps(self.generator.bit_generator.state)),
+                'block': np.array(self.block, dtype=np.float64),
+                'position': np.array(self.position)}
+
+    def set_state(self, state : dict):
+        """Restore a state returned by get_state"""
+        self.generator.bit_generator.state = json.loads(str(state['bit_generator']))
+        self.block = state['block'].tolist()
+        self.block_size = len(self.block)
+        self.position = int(state['position'])
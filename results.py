@@ -0,0 +1,37 @@
+"""Helper functions that write the outcome of a run to a numpy .npz file and
+read it back, so that the analysis and the plots can be produced later and
+on another machine. The accumulators are stored with the same get_state
+machinery used by the checkpoints, the parameters of the run and the
+per-chain summaries as JSON strings."""
+
+import argparse
+import json
+import numpy as np
+from checkpoint import get_diagrams_info_state, set_diagrams_info_state
+
+def to_json(value) -> np.ndarray :
+    """JSON string of a value made of dicts, lists and numbers, numpy
+    scalars and tuples included"""
+    return np.array(json.dumps(value, default=lambda item: item.item()
+                               if isinstance(item, np.generic) else str(item)))
+
+def save_results(path : str, diagrams_info : dict, args : argparse.Namespace):
+    """Write diagrams_info and the arguments of the run to path"""
+    state = get_diagrams_info_state(diagrams_info)
+    state['arguments'] = to_json(vars(args))
+    for key in ('Chains', 'Thermalization', 'Precision', 'Trace'):
+        if key in diagrams_info:
+            state[key.lower()] = to_json(diagrams_info[key])
+    np.savez(path, **state)
+
+def load_results(path : str) -> tuple :
+    """Read a file written by save_results.
+    Return diagrams_info and the arguments of the run as a Namespace"""
+    with np.load(path) as data:
+        state = {key: data[key] for key in data.files}
+    diagrams_info = {'Blocking': {'Order': None, 'Energy': None, 'Tau': None}}
+    set_diagrams_info_state(diagrams_info, state)
+    for key in ('Chains', 'Thermalization', 'Precision', 'Trace'):
+        if key.lower() in state:
+            diagrams_info[key] = json.loads(str(state[key.lower()]))
+    return diagrams_info, argparse.Namespace(**json.loads(str(state['arguments'])))
@@ -0,0 +1,142 @@
+"""Histogram reweighting of a finished chain to nearby electron energies mu
+and couplings g. The weight of a diagram depends on mu and g only through
+the lifetime tau and the order n,
+
+    W(mu, g) / W(mu0, g0) = (g/g0)**(2n) * exp(-(mu - mu0)*tau),
+
+so the traces of order and tau written with --trace-dir are enough to
+estimate the observables at other parameters. The Kish effective sample
+size of the weights tells how far the extrapolation can be trusted.
+
+Example:
+    python main.py run --g 1.0 --nsteps 1000000 --trace-dir traces
+    python reweighting.py traces --g 0.9 1.0 1.1 --mu -0.1 0 0.1
+"""
+
+import argparse
+import itertools
+import numpy as np
+from trace_writer import load_parameters, open_trace
+
+CHUNK_SIZE = 1 << 20
+
+class Reweighting:
+    """Weighted sums of the observables for one target (mu, g), folded one
+    chunk of the traces at a time. The weights are kept relative to the
+    largest log weight seen so far, so they never overflow"""
+    def __init__(self, parameters : dict, mu : float, g : float, tau_bins : int = 50):
+        self.parameters = parameters
+        self.mu = mu
+        self.g = g
+        self.log_shift = -np.inf
+        self.samples = 0
+        self.weights = 0.0
+        self.squared_weights = 0.0
+        self.order = 0.0
+        self.energy = 0.0
+        self.zero_order = 0.0
+        self.tau_edges = np.linspace(0, parameters['max_time'], tau_bins + 1)
+        self.tau_histogram = np.zeros(tau_bins, dtype=np.float64)
+
+    def log_weights(self, orders : np.ndarray, taus : np.ndarray) -> np.ndarray :
+        """Log of the weight ratio of each sample"""
+        return 2*orders*np.log(abs(self.g/self.parameters['g'])) - \
+            (self.mu - self.parameters['mu'])*taus
+
+    def push_arrays(self, orders : np.ndarray, energies : np.ndarray, taus : np.ndarray):
+        """Fold a chunk of samples"""
+        if len(orders) == 0:
+            return
+        log_weights = self.log_weights(orders, taus)
+        log_shift = max(self.log_shift, float(np.max(log_weights)))
+        if log_shift > self.log_shift:
+            scale = np.exp(self.log_shift - log_shift)
+            self.weights *= scale
+            self.squared_weights *= scale**2
+            self.order *= scale
+            self.energy *= scale
+            self.zero_order *= scale
+            self.tau_histogram *= scale
+            self.log_shift = log_shift
+        weights = np.exp(log_weights - self.log_shift)
+        self.samples += len(orders)
+        self.weights += float(np.sum(weights))
+        self.squared_weights += float(np.sum(weights**2))
+        self.order += float(np.dot(weights, orders))
+        self.energy += float(np.dot(weights, energies))
+        self.zero_order += float(np.sum(weights[orders == 0]))
+        tau_bins = np.minimum(np.searchsorted(self.tau_edges, taus, side='right') - 1,
+                              len(self.tau_histogram) - 1)
+        self.tau_histogram += np.bincount(tau_bins, weights=weights,
+                                          minlength=len(self.tau_histogram))
+
+    def effective_samples(self) -> float :
+        """Kish effective sample size (sum w)**2 / sum w**2, it ignores the
+        autocorrelation of the chain"""
+        if self.squared_weights == 0:
+            return 0.0
+        return self.weights**2/self.squared_weights
+
+    def green_function(self) -> tuple :
+        """G(tau) at the bin centers normalized with the zero order samples
+        as GreenFunctionAccumulator does"""
+        max_time = self.tau_edges[-1]
+        if self.mu == 0:
+            integral = max_time
+        else:
+            integral = -np.expm1(-self.mu*max_time)/self.mu
+        bin_width = self.tau_edges[1] - self.tau_edges[0]
+        green = np.full(len(self.tau_histogram), np.nan)
+        if self.zero_order > 0:
+            green = integral*self.tau_histogram/(self.zero_order*bin_width)
+        return 0.5*(self.tau_edges[1:] + self.tau_edges[:-1]), green
+
+    def result(self) -> dict :
+        """Reweighted means and the effective sample size"""
+        effective_samples = self.effective_samples()
+        return {'mu': self.mu, 'g': self.g,
+                'Mean_order': self.order/self.weights,
+                'Mean_energy': self.energy/self.weights,
+                'Effective_samples': effective_samples,
+                'Effective_fraction': effective_samples/max(self.samples, 1)}
+
+def reweight(trace_dir : str, targets : list, tau_bins : int = 50,
+             chunk_size : int = CHUNK_SIZE) -> list :
+    """Reweight the traces in trace_dir to each (mu, g) of targets, reading
+    the memory mapped traces one chunk at a time.
+    Return the Reweighting of each target"""
+    parameters = load_parameters(trace_dir)
+    trace = open_trace(trace_dir)
+    reweightings = [Reweighting(parameters, mu, g, tau_bins) for mu, g in targets]
+    for start in range(0, len(trace['Order']), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        orders = np.asarray(trace['Order'][chunk], dtype=np.int64)
+        energies = np.asarray(trace['Energy'][chunk])
+        taus = np.asarray(trace['Tau'][chunk])
+        for reweighting in reweightings:
+            reweighting.push_arrays(orders, energies, taus)
+    return reweightings
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Reweight the traces of a run to "
+                                     "other electron energies and couplings")
+    parser.add_argument('trace_dir', type=str, help="Directory written with --trace-dir")
+    parser.add_argument('--mu', dest='mu', type=float, nargs='+', default=None,
+                        help="Electron energies, the one of the run by default")
+    parser.add_argument('--g', dest='g', type=float, nargs='+', default=None,
+                        help="Electron phonon couplings, the one of the run by default")
+    parser.add_argument('--tau-bins', dest='tau_bins', type=int, default=50,
+                        help="Number of bins of the reweighted G(tau)")
+    args = parser.parse_args()
+
+    parameters = load_parameters(args.trace_dir)
+    targets = list(itertools.product(args.mu or [parameters['mu']],
+                                     args.g or [parameters['g']]))
+    print(f"{'mu':>8} {'g':>8} {'Mean order':>12} {'Mean energy':>12} {'Eff. samples':>14} "
+          f"{'Fraction':>10}")
+    for reweighting in reweight(args.trace_dir, targets, args.tau_bins):
+        result = reweighting.result()
+        print(f"{result['mu']:>8.4g} {result['g']:>8.4g} {result['Mean_order']:>12.5f} "
+              f"{result['Mean_energy']:>12.5f} {result['Effective_samples']:>14.1f} "
+              f"{result['Effective_fraction']:>10.2%}")
@@ -0,0 +1,67 @@
+"""Helper class that reports the progress of a running Markov chain in a
+small JSON file, rewritten every N steps from the thermalization and
+sampling loops. The file is written next to its destination and then
+renamed over it, so a scheduler polling the file always reads a complete
+snapshot. Only the current diagram and the running accumulators are read,
+so a snapshot costs about as much as a few updates.
+
+Example:
+    python main.py run --nsteps 100000000 --status-file status.json
+    watch cat status.json
+"""
+
+import json
+import math
+import os
+import time
+from polaron import Polaron
+
+def to_finite(value : float):
+    """JSON has no nan, missing estimates are written as null"""
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+class StatusWriter:
+    def __init__(self, path : str, every : int = 10000, chain : int = 0):
+        """Write the status of chain to path every steps"""
+        self.path = path
+        self.every = every
+        self.chain = chain
+        self.start = time.time()
+        self.last_time = time.perf_counter()
+        self.last_step = None
+        self.speed = None
+
+    def write(self, polaron : Polaron, phase : str, step : int, total_steps : int = None):
+        """Replace the status file with a snapshot of the chain at step of
+        phase, the speed is measured since the previous snapshot. A snapshot
+        at the same step as the previous one, as the final one can be, keeps
+        the last speed"""
+        now = time.perf_counter()
+        if step != self.last_step:
+            self.speed = None
+            if self.last_step is not None and now > self.last_time and step > self.last_step:
+                self.speed = (step - self.last_step)/(now - self.last_time)
+            self.last_time = now
+            self.last_step = step
+
+        diagrams_info = polaron.diagrams_info
+        status = {'Chain': self.chain, 'Phase': phase, 'Step': step,
+                  'Total_steps': total_steps, 'Steps_per_second': self.speed,
+                  'Elapsed': time.time() - self.start, 'Updated': time.time(),
+                  'Order': polaron.diagram['order'],
+                  'Tau': polaron.diagram['time_scaling'],
+                  'Acceptance': {name: to_finite(counters['Accepted']/counters['Proposed'])
+                                 if counters['Proposed'] else None
+                                 for name, counters in diagrams_info['Updates'].items()}}
+        for name, accumulator in diagrams_info['Blocking'].items():
+            sampled = len(accumulator.counts) > 0
+            status[f'Mean_{name.lower()}'] = to_finite(accumulator.mean()) if sampled else None
+            status[f'{name}_error'] = to_finite(accumulator.standard_error())
+        if 'Precision' in diagrams_info:
+            status['Precision'] = diagrams_info['Precision']
+
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump(status, file, indent=1)
+        os.replace(temporary, self.path)
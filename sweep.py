@@ -0,0 +1,191 @@
+"""Parameter sweep of the Holstein polaron. The points of a grid over g, omega
+and mu are scheduled across a pool of worker processes. Each point after the
+first ones is warm started from the thermalized diagram of a neighbour one
+grid step away, which needs far fewer burn-in steps than a zero order
+diagram. All the results are written to a single columnar table.
+
+Example:
+    python sweep.py --grid g=0.1:2.0:20 --grid mu=-1,-0.5,0 --nworkers 8
+"""
+
+import argparse
+import itertools
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+from montecarlo_parser import MonteCarloParser
+from polaron import Polaron
+from random_source import RandomSource
+from dmc import run_diagrammatic_montecarlo, run_thermalization_steps
+from parallel import spawn_seeds
+
+GRID_PARAMETERS = ('g', 'omega', 'mu')
+
+def parse_grid(grid_specs : list, args : argparse.Namespace) -> dict :
+    """Each spec is name=start:stop:num for a linear grid or name=v1,v2,...
+    for explicit values. Parameters without a spec keep the value in args"""
+    grid = {name: np.array([getattr(args, name)]) for name in GRID_PARAMETERS}
+    for spec in grid_specs or []:
+        name, values = spec.split('=')
+        if name not in GRID_PARAMETERS:
+            raise ValueError(f"Cannot sweep over {name}, choose among {GRID_PARAMETERS}")
+        if ':' in values:
+            start, stop, num = values.split(':')
+            grid[name] = np.linspace(float(start), float(stop), int(num))
+        else:
+            grid[name] = np.array([float(value) for value in values.split(',')])
+    return grid
+
+def get_points(grid : dict) -> np.ndarray :
+    """Cartesian product of the grid, one row for each point"""
+    return np.array(list(itertools.product(*(grid[name] for name in GRID_PARAMETERS))))
+
+def get_scale(points : np.ndarray) -> np.ndarray :
+    """Range of each parameter over the grid"""
+    scale = np.ptp(points, axis=0)
+    scale[scale == 0] = 1
+    return scale
+
+def eval_distances(points : np.ndarray, point : np.ndarray, scale : np.ndarray) -> np.ndarray :
+    """Distance between points with each parameter scaled to its grid range"""
+    return np.sqrt(np.sum(((points - point)/scale)**2, axis=1))
+
+def eval_summary(diagrams_info : dict, fit_start : float = None) -> dict :
+    """Means, errors and autocorrelation times of the observables and the
+    fit of the Green's function tail of a finished chain"""
+    summary = {}
+    for name, accumulator in diagrams_info['Blocking'].items():
+        name = name.lower()
+        summary[f'mean_{name}'] = accumulator.mean()
+        summary[f'{name}_error'] = accumulator.standard_error()
+        summary[f'{name}_tau_int'] = accumulator.autocorrelation_time()
+        summary[f'{name}_converged'] = accumulator.is_converged()
+    summary['samples'] = diagrams_info['Blocking']['Order'].counts[0]
+    fit = diagrams_info['Green'].fit_exponential_tail(fit_start)
+    summary['green_energy'] = fit['Energy']
+    summary['green_energy_error'] = fit['Energy_error']
+    summary['z_factor'] = fit['Z']
+    summary['z_factor_error'] = fit['Z_error']
+    return summary
+
+def run_point(args : argparse.Namespace, seed_sequence : np.random.SeedSequence,
+              diagram_state : dict = None) -> tuple :
+    """Run the chain for one point of the grid in accumulator mode.
+    If diagram_state is given the chain starts from it and only
+    args.warm_burn thermalization steps are performed.
+    Return the summary of the point and the final diagram state"""
+    polaron = Polaron(args, RandomSource(seed_sequence))
+    if diagram_state is not None:
+        polaron.set_diagram_state(diagram_state)
+        polaron.diagram['energy_outdated'] = True
+        polaron.eval_diagram_energy()
+        args = argparse.Namespace(**vars(args))
+        args.nsteps_burn = args.warm_burn
+    polaron = run_thermalization_steps(polaron, args)
+    polaron.update_diagrams_info()
+    diagrams_info = run_diagrammatic_montecarlo(polaron, args)
+
+    burn_steps = diagrams_info.get('Thermalization', {'Steps': args.nsteps_burn})['Steps']
+    sampling_steps = diagrams_info.get('Precision', {'Steps': args.nsteps})['Steps']
+    summary = {'burn_steps': burn_steps, 'sampling_steps': sampling_steps}
+    summary.update(eval_summary(diagrams_info, args.green_fit_start))
+    return summary, polaron.get_diagram_state()
+
+def get_point_args(args : argparse.Namespace, point : np.ndarray) -> argparse.Namespace :
+    point_args = argparse.Namespace(**vars(args))
+    for name, value in zip(GRID_PARAMETERS, point):
+        setattr(point_args, name, float(value))
+    point_args.accumulate = True
+    return point_args
+
+def get_grid_indices(grid : dict) -> np.ndarray :
+    """Position of each point of get_points along every grid axis"""
+    return np.array(list(itertools.product(*(range(len(grid[name]))
+                                             for name in GRID_PARAMETERS))))
+
+def get_cold_starts(points : np.ndarray, scale : np.ndarray, ncold : int) -> list :
+    """Indices of ncold points spread over the grid by farthest point
+    sampling from the first one"""
+    cold = [0]
+    while len(cold) < min(ncold, len(points)):
+        distances = np.min([eval_distances(points, points[index], scale) for index in cold],
+                           axis=0)
+        cold.append(int(np.argmax(distances)))
+    return cold
+
+def get_warm_starts(indices : np.ndarray, cold : list) -> np.ndarray :
+    """Breadth first search over the grid from the cold starts, moving one
+    grid step along one axis at a time. Each point is warm started from the
+    point it was reached from, -1 for the cold starts. Points are visited
+    in a fixed order, so the plan does not depend on the timing of the run"""
+    warm_start = np.full(len(indices), -1, dtype=np.int64)
+    visited = np.zeros(len(indices), dtype=bool)
+    visited[cold] = True
+    queue = list(cold)
+    while queue:
+        index = queue.pop(0)
+        steps = np.sum(np.abs(indices - indices[index]), axis=1)
+        for neighbour in np.flatnonzero((steps == 1) & ~visited):
+            visited[neighbour] = True
+            warm_start[neighbour] = index
+            queue.append(int(neighbour))
+    return warm_start
+
+def run_sweep(args : argparse.Namespace) -> dict :
+    """Schedule all the points of the grid on args.nworkers processes.
+    args.cold_starts points, spread over the grid, start from zero order
+    diagrams. Every other point warm starts from the diagram of a
+    neighbour one grid step away, and is submitted once that neighbour is
+    finished. The neighbour of each point and the seed of its chain are
+    fixed before the run, so the same --seed and --cold-starts reproduce
+    the sweep whatever the number of workers.
+    Return the columns of the results table"""
+    grid = parse_grid(args.grid, args)
+    points = get_points(grid)
+    cold = get_cold_starts(points, get_scale(points), args.cold_starts)
+    warm_start = get_warm_starts(get_grid_indices(grid), cold)
+    seeds = spawn_seeds(args.seed, len(points))
+    ready = sorted(cold)
+    finished = {}
+    results = [None]*len(points)
+
+    nworkers = args.nworkers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=nworkers) as executor:
+        running = {}
+        while ready or running:
+            while ready and len(running) < nworkers:
+                index = ready.pop(0)
+                diagram_state = finished.get(int(warm_start[index]))
+                running[executor.submit(run_point, get_point_args(args, points[index]),
+                                        seeds[index], diagram_state)] = index
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                results[index], finished[index] = future.result()
+                print(f"Point {index} of {len(points)} done: "
+                      f"{dict(zip(GRID_PARAMETERS, points[index].tolist()))}")
+                ready.extend(int(child) for child in np.flatnonzero(warm_start == index))
+            ready.sort()
+
+    columns = {name: points[:, column] for column, name in enumerate(GRID_PARAMETERS)}
+    for key in results[0]:
+        columns[key] = np.array([result[key] for result in results])
+    columns['warm_start'] = warm_start
+    return columns
+
+if __name__ == "__main__":
+
+    mc_parser = MonteCarloParser()
+    mc_parser.parser.add_argument('--grid', dest='grid', action='append',
+                        help="Grid of a parameter, name=start:stop:num or name=v1,v2,...")
+    mc_parser.parser.add_argument('--warm-burn', dest='warm_burn', type=int, default=1000,
+                        help="Thermalization steps of a warm started point")
+    mc_parser.parser.add_argument('--cold-starts', dest='cold_starts', type=int, default=4,
+                        help="Points of the grid started from a zero order diagram")
+    mc_parser.parser.add_argument('--output', dest='output', type=str,
+                        default='sweep_results.npz', help="Path of the results table")
+    args = mc_parser.parser.parse_args()
+    mc_parser.reject_options(args, ('engine', 'nchains', 'checkpoint_every', 'resume',
+                                    'cache_dir', 'trace_dir', 'status_file'),
+                             "is not supported by sweeps")
+    np.savez(args.output, **run_sweep(args))
@@ -0,0 +1,145 @@
+"""Parallel tempering of the Holstein polaron over a ladder of couplings.
+One chain runs for each value of g and every args.swap_every steps the
+diagrams of neighbouring chains are proposed for exchange. A diagram of
+order n weighs g**(2n), so swapping the diagrams of chains i and j is
+accepted with log ratio 2*(n_j - n_i)*(log|g_i| - log|g_j|). Diagrams stuck at
+high or low order in the strong coupling chains are carried along the
+ladder, and each chain still samples the distribution of its own g, so the
+run gives the results of every g at once.
+
+With --engine numba all the chains and the swaps run in one compiled loop.
+
+Example:
+    python tempering.py --ladder 0.5:2.0:8 --nsteps 1000000 --swap-every 10 --engine numba
+"""
+
+import argparse
+import math
+import numpy as np
+from montecarlo_parser import MonteCarloParser
+from polaron import Polaron, safe_log
+from random_source import RandomSource
+from dmc import eval_update
+from parallel import spawn_seeds
+from sweep import eval_summary
+
+CONFIGURATION = ('phonon_list', 'vertex_times', 'order', 'time_scaling', 'phonons_time',
+                 'total_energy', 'energy_outdated')
+
+def parse_ladder(spec : str) -> np.ndarray :
+    """Couplings of the ladder as start:stop:num or g1,g2,..."""
+    if ':' in spec:
+        start, stop, num = spec.split(':')
+        return np.linspace(float(start), float(stop), int(num))
+    return np.array([float(value) for value in spec.split(',')])
+
+def swap_diagrams(first : Polaron, second : Polaron):
+    """Exchange the diagrams of two chains, the couplings and the sampling
+    settings stay with their chains"""
+    for key in CONFIGURATION:
+        first.diagram[key], second.diagram[key] = second.diagram[key], first.diagram[key]
+
+def log_swap_ratio(first : Polaron, second : Polaron) -> float :
+    """Log of the weight ratio of the swapped and the current diagrams,
+    zero for diagrams of the same order even when a coupling is zero"""
+    order_change = second.diagram['order'] - first.diagram['order']
+    if order_change == 0:
+        return 0.0
+    return 2*order_change*(safe_log(abs(first.diagram['ep_coupling'])) -
+                           safe_log(abs(second.diagram['ep_coupling'])))
+
+def propose_swaps(replicas : list, random_source : RandomSource, swaps : np.ndarray,
+                  parity : int):
+    """Propose the exchange of each pair of neighbouring chains (k, k+1)
+    with k of the given parity, alternating the parity lets diagrams move
+    along the whole ladder. swaps holds proposed and accepted exchanges of
+    each pair by row"""
+    for pair in range(parity, len(replicas) - 1, 2):
+        swaps[0, pair] += 1
+        log_ratio = log_swap_ratio(replicas[pair], replicas[pair + 1])
+        if log_ratio >= 0 or math.log1p(-random_source.uniform()) < log_ratio:
+            swap_diagrams(replicas[pair], replicas[pair + 1])
+            swaps[1, pair] += 1
+
+def run_ladder_steps(replicas : list, nsteps : int, swap_every : int,
+                     random_source : RandomSource, swaps : np.ndarray, sample : bool):
+    """Advance every chain by nsteps steps, proposing swaps every swap_every
+    steps. If sample is True the steps are recorded in diagrams_info"""
+    for step in range(1, nsteps):
+        for replica in replicas:
+            eval_update(replica)
+            if sample:
+                replica.eval_diagram_energy()
+                replica.update_diagrams_info()
+        if swap_every > 0 and step % swap_every == 0:
+            propose_swaps(replicas, random_source, swaps, (step//swap_every) % 2)
+
+def run_tempering(args : argparse.Namespace) -> tuple :
+    """Thermalize and sample the chains of the ladder in args.ladder, each
+    with its own random stream spawned from args.seed. With the numba
+    engine the whole ladder runs in one compiled loop on a single stream.
+    Return the diagrams_info of each chain and the swap counters"""
+    couplings = parse_ladder(args.ladder)
+    seeds = spawn_seeds(args.seed, len(couplings) + 1)
+    if args.engine == 'numba':
+        from numba_polaron import run_numba_tempering, seed_numba_random
+        seed_numba_random(int(seeds[-1].generate_state(1)[0]))
+        return run_numba_tempering(args, couplings)
+    replicas = []
+    for g, seed in zip(couplings, seeds):
+        replica_args = argparse.Namespace(**vars(args))
+        replica_args.g = float(g)
+        replicas.append(Polaron(replica_args, RandomSource(seed)))
+    random_source = RandomSource(seeds[-1])
+    swaps = np.zeros((2, len(couplings) - 1), dtype=np.int64)
+    run_ladder_steps(replicas, args.nsteps_burn, args.swap_every, random_source, swaps, False)
+    for replica in replicas:
+        replica.eval_diagram_energy()
+        replica.update_diagrams_info()
+    swaps[:] = 0
+    run_ladder_steps(replicas, args.nsteps, args.swap_every, random_source, swaps, True)
+    return [replica.diagrams_info for replica in replicas], swaps
+
+def print_swap_rates(couplings : np.ndarray, swaps : np.ndarray):
+    """Print the acceptance of the exchanges between neighbouring chains"""
+    print(f"{'Pair':<20} {'Proposed':>10} {'Accepted':>10}")
+    for pair, (proposed, accepted) in enumerate(swaps.T):
+        label = f"g={couplings[pair]:.4g} <-> {couplings[pair + 1]:.4g}"
+        print(f"{label:<20} {proposed:>10} {accepted/max(proposed, 1):>10.2%}")
+
+if __name__ == "__main__":
+
+    mc_parser = MonteCarloParser()
+    mc_parser.parser.add_argument('--ladder', dest='ladder', type=str, required=True,
+                        help="Couplings of the chains, start:stop:num or g1,g2,...")
+    mc_parser.parser.add_argument('--swap-every', dest='swap_every', type=int, default=10,
+                        help="Steps of each chain between two rounds of swaps")
+    mc_parser.parser.add_argument('--output', dest='output', type=str,
+                        default='tempering_results.npz', help="Path of the results table")
+    args = mc_parser.parser.parse_args()
+    if args.engine == 'ensemble':
+        mc_parser.parser.error("tempering runs on the python or the numba engine")
+    mc_parser.reject_options(args, ('nchains', 'checkpoint_every', 'resume', 'cache_dir',
+                                    'trace_dir', 'status_file', 'adaptive_burn',
+                                    'target_error', 'timing_every'),
+                             "is not supported by tempering")
+    if args.engine == 'numba':
+        mc_parser.reject_options(args, ('shift_weight',),
+                                 "is not supported by the numba engine")
+
+    chains_info, swaps = run_tempering(args)
+    couplings = parse_ladder(args.ladder)
+    print_swap_rates(couplings, swaps)
+    summaries = [eval_summary(info, args.green_fit_start) for info in chains_info]
+    print(f"{'g':>8} {'Mean order':>12} {'Error':>10} {'Mean energy':>12} {'Error':>10} "
+          f"{'tau_int':>8}")
+    for g, summary in zip(couplings, summaries):
+        print(f"{g:>8.4g} {summary['mean_order']:>12.5f} {summary['order_error']:>10.2e} "
+              f"{summary['mean_energy']:>12.5f} {summary['energy_error']:>10.2e} "
+              f"{summary['order_tau_int']:>8.2f}")
+    columns = {'g': couplings,
+               'swaps_proposed': np.append(swaps[0], 0),
+               'swaps_accepted': np.append(swaps[1], 0)}
+    for key in summaries[0]:
+        columns[key] = np.array([summary[key] for summary in summaries])
+    np.savez(args.output, **columns)
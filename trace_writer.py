@@ -0,0 +1,93 @@
+"""Helper class that streams the per-step traces of the Markov chain to disk.
+Order (int32), energy and tau (float64) are buffered in fixed-size numpy
+chunks and appended to one .npy file each, so the RAM used does not grow
+with the length of the run and the files can be opened with np.load using
+mmap_mode='r'. The weight ratios between (mu, g) depend only on order and
+tau, see reweighting.py"""
+
+import json
+import os
+import numpy as np
+
+CHUNK_SIZE = 65536
+HEADER_SIZE = 128
+COLUMNS = {'Order': np.int32, 'Energy': np.float64, 'Tau': np.float64}
+PARAMETERS_FILE = 'parameters.json'
+
+def write_header(file, dtype, length : int):
+    """Write a npy version 1.0 header padded to HEADER_SIZE bytes, so that it
+    can be rewritten in place when the length of the trace changes"""
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % \
+        (np.lib.format.dtype_to_descr(np.dtype(dtype)), length)
+    header = header.ljust(HEADER_SIZE - 10 - 1) + '\n'
+    file.seek(0)
+    file.write(np.lib.format.magic(1, 0))
+    file.write(np.uint16(len(header)).tobytes())
+    file.write(header.encode('latin1'))
+
+def trace_path(directory : str, name : str) -> str :
+    return os.path.join(directory, f"{name.lower()}.npy")
+
+class TraceWriter:
+    def __init__(self, directory : str, chunk_size : int = CHUNK_SIZE, samples : int = 0,
+                 parameters : dict = None):
+        """Open the traces in directory. If samples is larger than zero the
+        existing traces are cut to that length and extended, as needed when
+        a run is resumed from a checkpoint. The parameters of the run, if
+        given, are written next to the traces"""
+        os.makedirs(directory, exist_ok=True)
+        if parameters is not None:
+            with open(os.path.join(directory, PARAMETERS_FILE), 'w') as file:
+                json.dump(parameters, file)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.samples = samples
+        self.files = {}
+        self.buffers = {}
+        for name, dtype in COLUMNS.items():
+            if samples > 0:
+                file = open(trace_path(directory, name), 'r+b')
+                file.truncate(HEADER_SIZE + samples*np.dtype(dtype).itemsize)
+                file.seek(0, os.SEEK_END)
+            else:
+                file = open(trace_path(directory, name), 'w+b')
+                write_header(file, dtype, 0)
+            self.files[name] = file
+            self.buffers[name] = np.empty(chunk_size, dtype=dtype)
+        self.position = 0
+
+    def push(self, order : int, energy : float, tau : float):
+        """Store the observables of the current diagram in the chunk"""
+        self.buffers['Order'][self.position] = order
+        self.buffers['Energy'][self.position] = energy
+        self.buffers['Tau'][self.position] = tau
+        self.position += 1
+        if self.position == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Append the filled part of the chunk to the files and update the
+        headers, after a flush the traces on disk are complete"""
+        for name, file in self.files.items():
+            file.seek(0, os.SEEK_END)
+            file.write(self.buffers[name][:self.position].tobytes())
+        self.samples += self.position
+        self.position = 0
+        for name, file in self.files.items():
+            write_header(file, COLUMNS[name], self.samples)
+            file.seek(0, os.SEEK_END)
+            file.flush()
+
+    def close(self):
+        self.flush()
+        for file in self.files.values():
+            file.close()
+
+def open_trace(directory : str) -> dict :
+    """Memory map the traces written by a TraceWriter"""
+    return {name: np.load(trace_path(directory, name), mmap_mode='r') for name in COLUMNS}
+
+def load_parameters(directory : str) -> dict :
+    """Parameters of the run stored next to the traces"""
+    with open(os.path.join(directory, PARAMETERS_FILE)) as file:
+        return json.load(file)